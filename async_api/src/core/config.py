@@ -17,4 +17,10 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 AUTH_SERVICE_USER_ROLES_URL = os.getenv('AUTH_SERVICE_USER_ROLES_URL')
 
+# When set, asymmetrically signed access tokens are verified locally
+# with the auth service public keys instead of calling the service
+AUTH_SERVICE_JWKS_URL = os.getenv('AUTH_SERVICE_JWKS_URL')
+AUTH_SERVICE_JWKS_CACHE_TIME = int(os.getenv('AUTH_SERVICE_JWKS_CACHE_TIME',
+                                             600))
+
 LIMITATION_MAX_RATING = float(os.getenv('LIMITATION_MAX_RATING'))
@@ -1,9 +1,68 @@
+import asyncio
+import time
+from typing import Optional
 from uuid import uuid4
 
-from fastapi import Request
 import aiohttp
+import jwt
 from aiohttp import ClientConnectionError
-from core.config import AUTH_SERVICE_USER_ROLES_URL
+from core.config import (AUTH_SERVICE_JWKS_CACHE_TIME, AUTH_SERVICE_JWKS_URL,
+                         AUTH_SERVICE_USER_ROLES_URL)
+from fastapi import Request
+
+
+class JWKSCache:
+    """Public keys of the auth service, refreshed periodically
+    and whenever a token is signed with an unknown key."""
+    keys: dict = dict()
+    loaded_at: float = 0
+
+    # Don't let tokens with random key ids hammer the auth service
+    MIN_REFRESH_INTERVAL = 10
+
+    async def refresh(self):
+        # Known keys are kept and retried later if the service is down
+        self.loaded_at = time.monotonic()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(AUTH_SERVICE_JWKS_URL,
+                                       timeout=3) as resp:
+                    resp.raise_for_status()
+                    jwks = await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # Down, timed out, an error status or not a JSON body
+            return
+        if not isinstance(jwks, dict):
+            return
+        self.keys = {jwk['kid']: jwk for jwk in jwks.get('keys', [])
+                     if 'kid' in jwk}
+
+    async def get_key(self, kid: str) -> Optional[dict]:
+        age = time.monotonic() - self.loaded_at
+        if age > AUTH_SERVICE_JWKS_CACHE_TIME or (
+                kid not in self.keys and age > self.MIN_REFRESH_INTERVAL):
+            await self.refresh()
+        return self.keys.get(kid)
+
+
+jwks_cache = JWKSCache()
+
+
+async def verify_access_token(token: str) -> Optional[dict]:
+    """Claims of the access token if it is signed by the auth service.
+    Tokens revoked before they expire are still accepted locally. """
+    try:
+        header = jwt.get_unverified_header(token)
+        jwk = await jwks_cache.get_key(header.get('kid'))
+        if not jwk:
+            return None
+        claims = jwt.decode(token, jwt.PyJWK(jwk).key,
+                            algorithms=[jwk['alg']])
+    except jwt.PyJWTError:
+        return None
+    if claims.get('type') != 'access':
+        return None
+    return claims
 
 
 class AuthUser:
@@ -15,6 +74,15 @@ class AuthUser:
         self.auth_header = auth_header
 
     async def load(self):
+        if AUTH_SERVICE_JWKS_URL:
+            claims = await verify_access_token(
+                self.auth_header.split().pop(-1))
+            if claims and 'roles' in claims:
+                self.user_id = claims.get('user_id')
+                self.roles = [{'role_name': role_name}
+                              for role_name in claims['roles']]
+                return True
+
         headers = {
             'Authorization': self.auth_header
         }
@@ -25,27 +25,66 @@ create table app.users_7 partition of app.users for values with (modulus 10, rem
 create table app.users_8 partition of app.users for values with (modulus 10, remainder 8);
 create table app.users_9 partition of app.users for values with (modulus 10, remainder 9);
 
+-- Directories of the logins and emails, unique across the partitions of the users,
+-- changed in the same transactions as the users. The foreign keys are checked at
+-- commit so a login can be claimed before the user is inserted.
+CREATE TABLE IF NOT EXISTS app.user_logins (
+    user_login              text        PRIMARY KEY,
+    user_id                 uuid        NOT NULL,
+    FOREIGN KEY (user_id)
+            REFERENCES app.users(user_id)
+            ON DELETE CASCADE
+            ON UPDATE CASCADE
+            DEFERRABLE INITIALLY DEFERRED
+);
+
+CREATE TABLE IF NOT EXISTS app.user_emails (
+    user_email              text        PRIMARY KEY,
+    user_id                 uuid        NOT NULL,
+    FOREIGN KEY (user_id)
+            REFERENCES app.users(user_id)
+            ON DELETE CASCADE
+            ON UPDATE CASCADE
+            DEFERRABLE INITIALLY DEFERRED
+);
+
 
 CREATE TABLE IF NOT EXISTS app.auth_events (
-    auth_event_id           uuid        PRIMARY KEY DEFAULT gen_random_uuid(),
+    auth_event_id           uuid        NOT NULL DEFAULT gen_random_uuid(),
     auth_event_owner_id     uuid        NOT NULL,
     auth_event_type         app.auth_event_type,
-    auth_event_time         timestamp with time zone DEFAULT (now()),
+    auth_event_time         timestamp with time zone NOT NULL DEFAULT (now()),
     auth_event_fingerprint  text        NOT NULL,
+     PRIMARY KEY (auth_event_id, auth_event_time),
     FOREIGN KEY (auth_event_owner_id)
             REFERENCES app.users (user_id)
             ON DELETE CASCADE
             ON UPDATE CASCADE
-);
+) partition by range(auth_event_time);
+-- Monthly partitions, the upcoming ones are created by: flask manage maintain-partitions
+create table app.auth_events_default partition of app.auth_events default;
+DO $$
+DECLARE
+    month date := date_trunc('month', now());
+BEGIN
+    FOR i IN 0..2 LOOP
+        EXECUTE format(
+            'create table app.auth_events_%s partition of app.auth_events '
+            'for values from (%L) to (%L)',
+            to_char(month, 'YYYY_MM'), month, month + interval '1 month');
+        month := month + interval '1 month';
+    END LOOP;
+END $$;
 
 CREATE TABLE IF NOT EXISTS app.tokens (
     token_id                uuid        PRIMARY KEY DEFAULT gen_random_uuid(),
     token_owner_id          uuid        NOT NULL,
     token_value             text        NOT NULL,
+    token_digest            bytea       NOT NULL,
     token_used              boolean     DEFAULT false,
     created_at              timestamp with time zone DEFAULT (now()),
     expires_at              timestamp with time zone DEFAULT (now()::DATE + 10),
-     UNIQUE (token_owner_id, token_value),
+     UNIQUE (token_owner_id, token_digest),
     FOREIGN KEY (token_owner_id)
             REFERENCES app.users(user_id)
             ON DELETE CASCADE
@@ -106,8 +145,8 @@ CREATE TABLE IF NOT EXISTS app.social_accounts (
             ON UPDATE CASCADE
 );
 
-CREATE INDEX ON app.users(user_login);
+CREATE INDEX ON app.auth_events(auth_event_owner_id, auth_event_time DESC);
 
-CREATE INDEX ON app.users(user_email);
+CREATE INDEX ON app.tokens USING hash (token_digest);
 
-CREATE INDEX ON app.tokens(token_value);
+CREATE INDEX ON app.tokens(expires_at, token_id);
@@ -1,8 +1,9 @@
 from http import HTTPStatus
 
 from core.containers import Container
+from core.limits import rate_limit
 from core.settings import config
-from core.utils import authenticate, rate_limit
+from core.utils import authenticate
 from dependency_injector.wiring import Provide, inject
 from flask import Blueprint, Response, jsonify, make_response, request
 from flask_jwt_extended import jwt_required
@@ -14,7 +15,7 @@ permission = Blueprint('permission', __name__, url_prefix='/permission')
 @permission.route('/', methods=['GET'])
 @jwt_required()
 @authenticate()
-@rate_limit(config.user_max_request_rate)
+@rate_limit(config.user_max_request_rate, per_route=True)
 @inject
 def get_permissions(
         user_id: str,
@@ -29,7 +30,7 @@ def get_permissions(
 @permission.route('/', methods=['POST'])
 @jwt_required()
 @authenticate()
-@rate_limit(config.user_max_request_rate)
+@rate_limit(config.user_max_request_rate, per_route=True)
 @inject
 def create_permission(
         user_id: str,
@@ -53,7 +54,7 @@ def create_permission(
 @permission.route('/<uuid:perm_uuid>', methods=['PATCH'])
 @jwt_required()
 @authenticate()
-@rate_limit(config.user_max_request_rate)
+@rate_limit(config.user_max_request_rate, per_route=True)
 @inject
 def edit_permission(user_id: str, perm_uuid: str,
                     perm_service: PermissionService = Provide[
@@ -76,7 +77,7 @@ def edit_permission(user_id: str, perm_uuid: str,
 @permission.route('/<uuid:perm_uuid>', methods=['DELETE'])
 @jwt_required()
 @authenticate()
-@rate_limit(config.user_max_request_rate)
+@rate_limit(config.user_max_request_rate, per_route=True)
 @inject
 def delete_permission(user_id: str, perm_uuid: str,
                       perm_service: PermissionService = Provide[
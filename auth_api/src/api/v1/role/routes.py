@@ -1,8 +1,9 @@
 from http import HTTPStatus
 
 from core.containers import Container
+from core.limits import rate_limit
 from core.settings import config
-from core.utils import authenticate, rate_limit
+from core.utils import authenticate
 from dependency_injector.wiring import Provide, inject
 from flask import Blueprint, Response, jsonify, make_response, request
 from flask_jwt_extended import jwt_required
@@ -15,7 +16,7 @@ role = Blueprint('role', __name__, url_prefix='/role')
 @role.route('/', methods=['GET'])
 @jwt_required()
 @authenticate()
-@rate_limit(config.user_max_request_rate)
+@rate_limit(config.user_max_request_rate, per_route=True)
 @inject
 def get_roles(
         user_id: str,
@@ -30,7 +31,7 @@ def get_roles(
 @role.route('/', methods=['POST'])
 @jwt_required()
 @authenticate()
-@rate_limit(config.user_max_request_rate)
+@rate_limit(config.user_max_request_rate, per_route=True)
 @inject
 def create_role(
         user_id: str,
@@ -49,7 +50,7 @@ def create_role(
 @role.route('/<uuid:role_uuid>', methods=['PATCH'])
 @jwt_required()
 @authenticate()
-@rate_limit(config.user_max_request_rate)
+@rate_limit(config.user_max_request_rate, per_route=True)
 @inject
 def edit_role(user_id: str, role_uuid: str,
               role_service: RoleService = Provide[Container.role_service]):
@@ -70,7 +71,7 @@ def edit_role(user_id: str, role_uuid: str,
 @role.route('/<uuid:role_uuid>', methods=['DELETE'])
 @jwt_required()
 @authenticate()
-@rate_limit(config.user_max_request_rate)
+@rate_limit(config.user_max_request_rate, per_route=True)
 @inject
 def delete_role(user_id: str, role_uuid: str,
                 role_service: RoleService = Provide[Container.role_service]):
@@ -85,7 +86,7 @@ def delete_role(user_id: str, role_uuid: str,
 @role.route('/<uuid:role_uuid>/permissions', methods=['GET'])
 @jwt_required()
 @authenticate()
-@rate_limit(config.user_max_request_rate)
+@rate_limit(config.user_max_request_rate, per_route=True)
 @inject
 def get_role_permissions(
         user_id: str,
@@ -101,7 +102,7 @@ def get_role_permissions(
 @role.route('/<uuid:role_uuid>/permissions', methods=['POST'])
 @jwt_required()
 @authenticate()
-@rate_limit(config.user_max_request_rate)
+@rate_limit(config.user_max_request_rate, per_route=True)
 @inject
 def set_role_permissions(
         user_id: str,
@@ -125,7 +126,7 @@ def set_role_permissions(
             methods=['DELETE'])
 @jwt_required()
 @authenticate()
-@rate_limit(config.user_max_request_rate)
+@rate_limit(config.user_max_request_rate, per_route=True)
 @inject
 def remove_role_permissions(
         user_id: str,
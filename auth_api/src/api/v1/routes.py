@@ -2,7 +2,8 @@ from api.v1.oauth.routes import oauth
 from api.v1.permission.routes import permission
 from api.v1.role.routes import role
 from api.v1.user.routes import user
-from flask import Blueprint, jsonify
+from core.metrics import metrics
+from flask import Blueprint, current_app, jsonify
 
 v1 = Blueprint('v1', __name__, url_prefix='/v1')
 v1.register_blueprint(user)
@@ -14,3 +15,14 @@ v1.register_blueprint(oauth)
 @v1.route('/')
 def index():
     return jsonify(result="Hello, World!")
+
+
+@v1.route('/metrics')
+def get_metrics():
+    return jsonify(metrics.snapshot())
+
+
+@v1.route('/.well-known/jwks.json')
+def get_jwks():
+    """Public keys verifying the access tokens signed asymmetrically. """
+    return jsonify(current_app.config['JWKS'])
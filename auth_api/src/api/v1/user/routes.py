@@ -2,14 +2,17 @@ from http import HTTPStatus
 from time import sleep
 
 from core.containers import Container
+from core.limits import concurrency_limit, rate_limit
 from core.settings import config
-from core.utils import ServiceException, authenticate, rate_limit
+from core.throttle import preauth_throttle
+from core.utils import ServiceException, authenticate
 from dependency_injector.wiring import Provide, inject
-from flask import Blueprint, Response, jsonify, make_response, request
+from flask import (Blueprint, Response, json, jsonify, make_response, request,
+                   stream_with_context)
 from flask_jwt_extended import get_jwt, jwt_required
 from models.permission import Permission
 from models.role import Role
-from services.user import UserService
+from services.user import HISTORY_PAGE_SIZE, UserService
 from services.user_perms import UserPermsService
 from services.user_role import UserRoleService
 
@@ -17,6 +20,7 @@ user = Blueprint('user', __name__, url_prefix='/user')
 
 
 @user.route('/signup', methods=["POST"])
+@preauth_throttle()
 @inject
 def signup(user_service: UserService = Provide[Container.user_service]):
     """ Creates a new user and returns it's access and refresh tokens """
@@ -38,6 +42,7 @@ def signup(user_service: UserService = Provide[Container.user_service]):
 
 
 @user.route('/auth', methods=["POST"])
+@preauth_throttle(by_login=True)
 @inject
 def login(user_service: UserService = Provide[Container.user_service]):
     """ Log user in using username and password.
@@ -83,7 +88,7 @@ def refresh(user_service: UserService = Provide[Container.user_service]):
 @user.route('/auth/logout', methods=["POST"])
 @jwt_required()
 @authenticate()
-@rate_limit(config.user_max_request_rate)
+@rate_limit(config.user_max_request_rate, per_route=True)
 @inject
 def logout(user_id: str,
            user_service: UserService = Provide[Container.user_service]):
@@ -104,7 +109,7 @@ def logout(user_id: str,
 @user.route('/auth', methods=["PATCH"])
 @jwt_required()
 @authenticate()
-@rate_limit(config.user_max_request_rate)
+@rate_limit(config.user_max_request_rate, per_route=True)
 @inject
 def modify(
         user_id: str,
@@ -125,17 +130,32 @@ def modify(
 @user.route('/auth', methods=["GET"])
 @jwt_required()
 @authenticate()
-@rate_limit(config.user_max_request_rate)
+@rate_limit(config.user_max_request_rate, per_route=True)
 @inject
 def auth_history(user_id: str,
                  user_service: UserService = Provide[Container.user_service]
                  ):
+    """ Returns a page of the authentication history, newest first,
+    the next page is requested with the cursor of the X-Next-Cursor
+    header. With stream=true the whole history is streamed as NDJSON """
+    after = request.args.get('after')
+    limit = request.args.get('limit', HISTORY_PAGE_SIZE, type=int)
     try:
-        history = user_service.get_auth_history(user_id)
+        if request.args.get('stream') == 'true':
+            events = user_service.stream_auth_history(user_id, after)
+            return Response(
+                stream_with_context(json.dumps(event) + '\n'
+                                    for event in events),
+                mimetype='application/x-ndjson')
+        history, next_cursor = user_service.get_auth_history(
+            user_id, limit, after)
     except ServiceException as err:
         return make_response(jsonify(err), 400)
 
-    return make_response(jsonify(history), HTTPStatus.OK)
+    response = make_response(jsonify(history), HTTPStatus.OK)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 
 @user.route('/<uuid:user_uuid>/roles', methods=['POST'])
@@ -161,6 +181,27 @@ def assign_user_role(
     )
 
 
+@user.route('/roles/bulk', methods=['POST', 'DELETE'])
+@jwt_required()
+@authenticate()
+@inject
+def bulk_user_roles(
+        user_id: str,
+        user_role_service: UserRoleService = Provide[
+            Container.user_role_service]):
+    """ Assigns (POST) or removes (DELETE) many roles of many users
+    in a single transaction, with a result for every pair """
+    bulk_request = user_role_service.validate_bulk_assignment(request)
+    if isinstance(bulk_request, Response):
+        return bulk_request
+    user_role_service.check_superuser_authorization(user_id)
+    if request.method == 'POST':
+        results = user_role_service.assign_user_roles(bulk_request.pairs())
+    else:
+        results = user_role_service.revoke_user_roles(bulk_request.pairs())
+    return make_response(jsonify(results=results), HTTPStatus.OK)
+
+
 @user.route('/<uuid:user_uuid>/roles', methods=['GET'])
 @jwt_required()
 @authenticate()
@@ -240,12 +281,26 @@ def check_user_perm(
                    is_permitted=is_permitted)
 
 
+@user.route('/permissions/check', methods=['POST'])
+@inject
+def check_user_perms(
+        user_perm_service: UserPermsService = Provide[
+            Container.user_perm_service]):
+    """ Checks many permissions at once, given as (user, permission)
+    pairs or as one user and a list of permissions """
+    check_request = user_perm_service.validate_checks(request)
+    if isinstance(check_request, Response):
+        return check_request
+    results = user_perm_service.check_user_perms(check_request.pairs())
+    return jsonify(results=results)
+
+
 @user.route('/slow', methods=['GET'])
 @jwt_required()
 @authenticate()
-@rate_limit(config.user_max_request_rate)
+@concurrency_limit(config.user_max_concurrent_requests)
 def slow(user_id: str):
-    """Stub handle used for testing rate limiting
+    """Stub handle used for testing concurrency limiting
     in tests/functional/src/test_rate_limit.py """
 
     sleep(5)
@@ -0,0 +1,121 @@
+import math
+from hashlib import blake2b
+from itertools import islice
+from typing import Iterable
+
+from db.redis_client import redis, redis_batch
+from redis import RedisError
+
+
+def bloom_parameters(capacity: int, error_rate: float) -> tuple[int, int]:
+    """Number of bits and hash functions giving the false positive
+    rate for the expected number of items."""
+    size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    hashes = max(1, round(size / capacity * math.log(2)))
+    return size, hashes
+
+
+def bloom_positions(item: str, size: int, hashes: int) -> list[int]:
+    """Bit positions of the item, using double hashing of one digest."""
+    digest = blake2b(item.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    return [(h1 + i * h2) % size for i in range(hashes)]
+
+
+class BloomFilter:
+    """In-process Bloom filter: no false negatives, rare false positives."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.size, self.hashes = bloom_parameters(capacity, error_rate)
+        self.bits = bytearray(math.ceil(self.size / 8))
+
+    def add(self, item: str) -> None:
+        for pos in bloom_positions(item, self.size, self.hashes):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in bloom_positions(item, self.size, self.hashes))
+
+
+# Sets the bits of an item in the filter and, while a rebuild is running,
+# in the filter being built so the item isn't lost when it replaces this one
+ADD_SCRIPT = """
+local building = redis.call('EXISTS', KEYS[2]) == 1
+for _, pos in ipairs(ARGV) do
+    redis.call('SETBIT', KEYS[1], pos, 1)
+    if building then
+        redis.call('SETBIT', KEYS[2], pos, 1)
+    end
+end
+"""
+
+
+class RedisBloomFilter:
+    """Bloom filter in a Redis bitmap, shared by all the workers.
+
+    The filter is only trusted once built by ``rebuild`` for the same
+    parameters, until then every item may be in it. """
+
+    def __init__(self, key: str, capacity: int, error_rate: float = 0.01):
+        self.key = key
+        self.size, self.hashes = bloom_parameters(capacity, error_rate)
+        self._building_key = f'{key}:building'
+        self._ready_key = f'{key}:ready'
+        self._add = redis.register_script(ADD_SCRIPT)
+
+    @property
+    def _parameters(self) -> str:
+        return f'{self.size}:{self.hashes}'
+
+    def add(self, *items: str) -> None:
+        """Add the items in a single round trip. Call it before the items
+        are committed: if they can't be added the filter is distrusted
+        until rebuilt, and if that fails too the error is raised. """
+        try:
+            with redis_batch() as pipe:
+                for item in items:
+                    self._add(keys=[self.key, self._building_key],
+                              args=bloom_positions(item, self.size,
+                                                   self.hashes),
+                              client=pipe)
+        except RedisError:
+            redis.delete(self._ready_key)
+
+    def might_contain(self, item: str) -> bool:
+        """False only for items certainly never added, in a single round
+        trip. True whenever the filter can't tell, e.g. Redis is down."""
+        try:
+            with redis_batch() as pipe:
+                pipe.get(self._ready_key)
+                # The bitmap may have been evicted without the marker
+                pipe.exists(self.key)
+                for pos in bloom_positions(item, self.size, self.hashes):
+                    pipe.getbit(self.key, pos)
+                ready, exists, *bits = pipe.execute()
+        except RedisError:
+            return True
+        if (ready is None or ready.decode() != self._parameters
+                or not exists):
+            return True
+        return all(bits)
+
+    def rebuild(self, items: Iterable[str], batch_size: int = 10000) -> int:
+        """Replace the filter with one of the items, the ones added
+        meanwhile included. Returns the number of items. """
+        redis.delete(self._building_key)
+        # Allocated upfront: adds go to both filters from now on
+        redis.setbit(self._building_key, self.size - 1, 0)
+        items = iter(items)
+        count = 0
+        for batch in iter(lambda: list(islice(items, batch_size)), []):
+            with redis_batch() as pipe:
+                for item in batch:
+                    for pos in bloom_positions(item, self.size, self.hashes):
+                        pipe.setbit(self._building_key, pos, 1)
+            count += len(batch)
+        with redis_batch(transaction=True) as pipe:
+            pipe.rename(self._building_key, self.key)
+            pipe.set(self._ready_key, self._parameters)
+        return count
@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from core.settings import config
+from db.redis_client import deferred_redis, redis
+from redis import RedisError
+
+TOKEN_NAMESPACE = 'token'
+PERMS_NAMESPACE = 'perms'
+ROLE_IDS_NAMESPACE = 'role_id'
+USER_ROLES_NAMESPACE = 'user_roles'
+
+
+class TTLCache:
+    """Bounded in-process LRU cache with a per-entry expiry timestamp.
+
+    The cache starts disabled: it is only trusted while the invalidation
+    listener is subscribed, otherwise other workers' invalidations
+    could be missed and stale entries served.
+
+    An entry computed from data read before ``version()`` is only set if
+    nothing was invalidated meanwhile, so it can't be staler than what an
+    invalidation has just dropped. """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.enabled = False
+        self._data: OrderedDict = OrderedDict()
+        self._invalidations = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if not self.enabled:
+            return default
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def version(self) -> int:
+        return self._invalidations
+
+    def set(self, key: Hashable, value: Any, expires_at: float,
+            version: int = None) -> None:
+        if not self.enabled or expires_at <= time.time():
+            return
+        with self._lock:
+            if version is not None and version != self._invalidations:
+                return
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._invalidations += 1
+            self._data.pop(key, None)
+
+    invalidate = delete
+
+    def clear(self) -> None:
+        with self._lock:
+            self._invalidations += 1
+            self._data.clear()
+
+    def enable(self) -> None:
+        self.clear()
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+        self.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class InvalidationListener:
+    """Drop entries from in-process caches of every worker.
+
+    Invalidations are published to a Redis pub/sub channel as
+    ``<namespace>:<key>`` and dispatched by a background listener in
+    each worker to the subscriber registered under that namespace.
+    A subscriber implements ``invalidate(key)``, ``enable()`` and
+    ``disable()``, the latter two are called when the listener
+    (re)subscribes or loses the connection. """
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self._caches: dict[str, Any] = {}
+        self._thread = None
+
+    def register(self, namespace: str, cache: Any) -> Any:
+        self._caches[namespace] = cache
+        return cache
+
+    @staticmethod
+    def message(namespace: str, key: str) -> str:
+        return f'{namespace}:{key}'
+
+    def invalidate_locally(self, namespace: str, key: str) -> None:
+        cache = self._caches.get(namespace)
+        if cache:
+            cache.invalidate(key)
+
+    def publish(self, namespace: str, key: str) -> None:
+        """Invalidate the key in this worker and broadcast it to others."""
+        self.invalidate_locally(namespace, key)
+        with deferred_redis() as pipe:
+            pipe.publish(self.channel, self.message(namespace, key))
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._listen, daemon=True)
+        self._thread.start()
+
+    def _dispatch(self, data: bytes) -> None:
+        namespace, _, key = data.decode().partition(':')
+        self.invalidate_locally(namespace, key)
+
+    def _listen(self) -> None:
+        while True:
+            try:
+                pubsub = redis.pubsub()
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        # Anything published before the subscription
+                        # was lost, so the caches start empty
+                        for cache in self._caches.values():
+                            cache.enable()
+                    elif message['type'] == 'message':
+                        self._dispatch(message['data'])
+            except RedisError:
+                for cache in self._caches.values():
+                    cache.disable()
+                time.sleep(1)
+
+
+invalidation = InvalidationListener(config.cache_invalidation_channel)
+
+# Recently verified access tokens: token jti -> True until the token exp
+token_cache = invalidation.register(TOKEN_NAMESPACE,
+                                    TTLCache(config.token_cache_size))
+
+# Permission decisions by user: user_id -> {permission_id: is_permitted}
+perms_cache = invalidation.register(PERMS_NAMESPACE,
+                                    TTLCache(config.perms_cache_size))
+
+# Role IDs by role name, a handful of entries
+role_id_cache = invalidation.register(ROLE_IDS_NAMESPACE, TTLCache(1000))
+
+# Roles owned by user: user_id -> frozenset of role_ids
+user_roles_cache = invalidation.register(USER_ROLES_NAMESPACE,
+                                         TTLCache(config.perms_cache_size))
@@ -1,13 +1,30 @@
+import csv
 import getpass
+import statistics
+import time
+from uuid import UUID, uuid4
 
+import click
 from core.containers import Container
+from core.settings import config
 from core.utils import ServiceException
-from db.pg import db
+from db.partitions import maintain_monthly_partitions
+from db.pg import count_queries, db
+from db.token_reaper import partition_tokens_table, reap_expired_tokens
 from dependency_injector.wiring import Provide
 from flask import Blueprint
+from models.permission import Permission
+from models.role import Role
+from models.role_permissions import RolePermission
+from models.roles_owners import RoleOwner
+from models.user import User
 from services.role import RoleService
 from services.user import UserService
-from services.user_role import UserRoleService
+from services.user_filter import rebuild_user_filters
+from services.user_import import IMPORT_FORMATS, import_users, read_users
+from services.user_perms import UserPermsService
+from services.user_role import BULK_CHUNK_SIZE, UserRoleService
+from sqlalchemy import text
 
 commands = Blueprint('manage', __name__)
 
@@ -30,7 +47,7 @@ def create_superuser(username: str, password: str, email: str,
                      ]
                      ):
     # Create the user
-    user = user_service.create_user(username, password, email)
+    user_id = user_service.create_user(username, password, email)
 
     superadmin_role = None
     superadmin_role_name = 'superadmin'
@@ -46,11 +63,10 @@ def create_superuser(username: str, password: str, email: str,
         superadmin_role = role_service.create_role(superadmin_role_name)
 
     # add the role to the user
-    user_role_service.assign_user_role(user.user_id,
-                                       superadmin_role.role_id)
+    user_role_service.assign_user_role(user_id, superadmin_role.role_id)
     db.session.commit()
 
-    return user
+    return user_id
 
 
 @commands.cli.command('createsuperuser')
@@ -72,3 +88,316 @@ def create():
         return
 
     print('Admin user created')
+
+
+# Adds the digest column to the tokens table created before it existed:
+# flask manage migrate-token-digests
+#
+# Rows are backfilled in small transactions so the table stays writable,
+# tokens issued meanwhile already get their digest from the application.
+#
+
+def migrate_token_digests(batch_size: int):
+    tokens = f'{config.pg_schema}.tokens'
+    db.session.execute(text(
+        f'ALTER TABLE {tokens} ADD COLUMN IF NOT EXISTS token_digest bytea'))
+    db.session.commit()
+
+    backfill = text(
+        f'UPDATE {tokens} '
+        f"SET token_digest = sha256(convert_to(token_value, 'UTF8')) "
+        f'WHERE token_id IN (SELECT token_id FROM {tokens} '
+        f'WHERE token_digest IS NULL LIMIT :batch_size)')
+    backfilled = 0
+    while True:
+        rowcount = db.session.execute(
+            backfill, {'batch_size': batch_size}).rowcount
+        db.session.commit()
+        if not rowcount:
+            break
+        backfilled += rowcount
+        print(f'Backfilled {backfilled} tokens')
+
+    for statement in (
+            f'ALTER TABLE {tokens} ALTER COLUMN token_digest SET NOT NULL',
+            f'CREATE INDEX IF NOT EXISTS tokens_token_digest_idx '
+            f'ON {tokens} USING hash (token_digest)',
+            f'CREATE UNIQUE INDEX IF NOT EXISTS '
+            f'tokens_token_owner_id_token_digest_key '
+            f'ON {tokens} (token_owner_id, token_digest)',
+            f'ALTER TABLE {tokens} '
+            f'DROP CONSTRAINT IF EXISTS tokens_token_owner_id_token_value_key',
+            f'DROP INDEX IF EXISTS {config.pg_schema}.tokens_token_value_idx'):
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+@commands.cli.command('migrate-token-digests')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Tokens updated per transaction.')
+def migrate_tokens(batch_size: int):
+    migrate_token_digests(batch_size)
+    print('Token digests migrated')
+
+
+# Creates the login and email directories of a database created before
+# them and fills them from the users:
+# flask manage migrate-user-directory
+#
+# Users are read in batches by id, each batch in its own transaction.
+# Logins or emails shared by several users are reported, the directory
+# keeps the first one found.
+#
+
+DIRECTORY_COLUMNS = {'user_logins': 'user_login', 'user_emails': 'user_email'}
+
+
+def migrate_user_directory(batch_size: int) -> dict[str, int]:
+    """Returns the number of conflicting users of each directory."""
+    schema = config.pg_schema
+    conflicts = {}
+    for table, column in DIRECTORY_COLUMNS.items():
+        db.session.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {schema}.{table} ('
+            f'{column} text PRIMARY KEY, '
+            f'user_id uuid NOT NULL REFERENCES {schema}.users(user_id) '
+            f'ON DELETE CASCADE ON UPDATE CASCADE '
+            f'DEFERRABLE INITIALLY DEFERRED)'))
+        db.session.commit()
+
+        backfill = text(
+            f'WITH batch AS (SELECT user_id, {column} FROM {schema}.users '
+            f'WHERE user_id > :after ORDER BY user_id LIMIT :batch_size), '
+            f'inserted AS (INSERT INTO {schema}.{table} ({column}, user_id) '
+            f'SELECT {column}, user_id FROM batch '
+            f'ON CONFLICT DO NOTHING RETURNING user_id) '
+            f'SELECT (SELECT user_id FROM batch '
+            f'ORDER BY user_id DESC LIMIT 1), '
+            f'(SELECT count(*) FROM batch), (SELECT count(*) FROM inserted)')
+        after = UUID(int=0)
+        conflicts[table] = 0
+        while True:
+            last, read, inserted = db.session.execute(
+                backfill, {'after': after, 'batch_size': batch_size}).one()
+            db.session.commit()
+            if not read:
+                break
+            # Users already in the directory conflict with themselves
+            conflicts[table] += db.session.execute(text(
+                f'SELECT count(*) FROM {schema}.users u '
+                f'JOIN {schema}.{table} d USING ({column}) '
+                f'WHERE u.user_id > :after AND u.user_id <= :last '
+                f'AND d.user_id <> u.user_id'),
+                {'after': after, 'last': last}).scalar()
+            after = last
+            print(f'{table}: {inserted} of {read} users added')
+    return conflicts
+
+
+@commands.cli.command('migrate-user-directory')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Users added per transaction.')
+def migrate_directory(batch_size: int):
+    conflicts = migrate_user_directory(batch_size)
+    for table, count in conflicts.items():
+        if count:
+            print(f'{count} users share an entry of {table} with another')
+    print('User directories migrated')
+
+
+# Deletes the expired refresh tokens, e.g. from cron:
+# flask manage reap-tokens
+#
+
+@commands.cli.command('reap-tokens')
+@click.option('--batch-size', default=config.token_reaper_batch_size,
+              show_default=True, help='Tokens deleted per transaction.')
+@click.option('--pause', default=config.token_reaper_pause,
+              show_default=True, help='Seconds to sleep between batches.')
+def reap_tokens(batch_size: int, pause: float):
+    reaped = reap_expired_tokens(batch_size, pause)
+    print(f'{reaped} expired tokens deleted')
+
+
+# Converts the tokens table into monthly partitions by expiry date,
+# which the reaper then drops as a whole once they expire:
+# flask manage partition-tokens
+#
+
+@commands.cli.command('partition-tokens')
+def partition_tokens():
+    copied = partition_tokens_table()
+    print(f'Tokens table partitioned, {copied} tokens kept')
+
+
+# Creates the monthly partitions of the auth events ahead of time and
+# drops the ones past the retention period, e.g. daily from cron:
+# flask manage maintain-partitions --retention-months 12
+#
+
+@commands.cli.command('maintain-partitions')
+@click.option('--months-ahead', default=3, show_default=True,
+              help='Months to create partitions for in advance.')
+@click.option('--retention-months', default=0, show_default=True,
+              help='Months of auth events to keep, 0 keeps them all.')
+def maintain_partitions(months_ahead: int, retention_months: int):
+    dropped = maintain_monthly_partitions('auth_events', months_ahead,
+                                          retention_months)
+    for name in dropped:
+        print(f'Dropped partition {name}')
+    print('Auth events partitions are up to date')
+
+
+# Measures the permissions lookup of users with more and more roles:
+# flask manage benchmark-perms --roles 1 --roles 10 --roles 100
+#
+# The users, roles and permissions are created in a transaction
+# rolled back at the end, nothing is left in the database.
+#
+
+def benchmark_user_perms(role_counts: list[int], perms_per_role: int,
+                         repeat: int,
+                         user_perms_service: UserPermsService = Provide[
+                             Container.user_perm_service]
+                         ) -> list[tuple[int, int, float]]:
+    results = []
+    try:
+        for role_count in role_counts:
+            user = User(user_login=f'benchmark_{uuid4().hex}',
+                        user_password='',
+                        user_email=f'{uuid4().hex}@benchmark.local')
+            db.session.add(user)
+            for _ in range(role_count):
+                role = Role(role_name=f'benchmark_{uuid4().hex}')
+                perms = [Permission(permission_name=f'benchmark_{uuid4().hex}')
+                         for _ in range(perms_per_role)]
+                db.session.add(role)
+                db.session.add_all(perms)
+                db.session.flush()
+                db.session.add(RoleOwner(owner_id=user.user_id,
+                                         role_id=role.role_id))
+                db.session.add_all(
+                    RolePermission(role_id=role.role_id,
+                                   permission_id=perm.permission_id)
+                    for perm in perms)
+            db.session.flush()
+
+            timings = []
+            for _ in range(repeat):
+                # Nothing is answered from the identity map
+                db.session.expire_all()
+                started = time.perf_counter()
+                with count_queries() as statements:
+                    user_perms_service.get_user_perms_list(user.user_id)
+                timings.append(time.perf_counter() - started)
+            results.append((role_count, len(statements),
+                            statistics.median(timings)))
+    finally:
+        db.session.rollback()
+    return results
+
+
+@commands.cli.command('benchmark-perms')
+@click.option('--roles', 'role_counts', multiple=True, type=int,
+              default=[1, 10, 100], show_default=True,
+              help='Number of roles of a benchmarked user, repeatable.')
+@click.option('--perms-per-role', default=3, show_default=True)
+@click.option('--repeat', default=20, show_default=True)
+def benchmark_perms(role_counts: tuple[int], perms_per_role: int,
+                    repeat: int):
+    print('roles  queries  median ms')
+    for role_count, queries, median in benchmark_user_perms(
+            list(role_counts), perms_per_role, repeat):
+        print(f'{role_count:>5}  {queries:>7}  {median * 1000:>9.2f}')
+
+
+# Assigns or removes roles in bulk from a CSV file of user_id,role_id rows:
+# flask manage assign-roles assignments.csv [--revoke]
+#
+
+def change_user_roles(pairs: list[tuple[str, str]], revoke: bool,
+                      user_role_service: UserRoleService = Provide[
+                          Container.user_role_service]
+                      ) -> list[dict]:
+    if revoke:
+        return user_role_service.revoke_user_roles(pairs)
+    return user_role_service.assign_user_roles(pairs)
+
+
+def report_role_changes(results: list[dict]) -> tuple[int, int]:
+    changed = failed = 0
+    for result in results:
+        if 'error' in result:
+            failed += 1
+            print(f"{result['user_uuid']},{result['role_uuid']}: "
+                  f"{result['error']}")
+        else:
+            changed += 1
+    return changed, failed
+
+
+@commands.cli.command('assign-roles')
+@click.argument('assignments', type=click.File('r'))
+@click.option('--revoke', is_flag=True, help='Remove the roles instead.')
+def assign_roles(assignments, revoke: bool):
+    changed = failed = 0
+    pairs = []
+    for line_number, row in enumerate(csv.reader(assignments), 1):
+        if not row:
+            continue
+        try:
+            pairs.append((UUID(row[0].strip()), UUID(row[1].strip())))
+        except (ValueError, IndexError):
+            failed += 1
+            print(f'Line {line_number}: expected user_id,role_id')
+            continue
+        # A transaction per batch of pairs
+        if len(pairs) == BULK_CHUNK_SIZE * 10:
+            counts = report_role_changes(change_user_roles(pairs, revoke))
+            changed, failed = changed + counts[0], failed + counts[1]
+            pairs = []
+    if pairs:
+        counts = report_role_changes(change_user_roles(pairs, revoke))
+        changed, failed = changed + counts[0], failed + counts[1]
+    print(f'{changed} roles {"removed" if revoke else "assigned"}, '
+          f'{failed} failed')
+
+
+# Imports users from a CSV file with a header or from NDJSON lines,
+# '-' reads the standard input:
+# flask manage import-users users.csv
+#
+# Rows have username, email and either password or password_hash
+# (a hash made by werkzeug.security, imported as is).
+#
+
+@commands.cli.command('import-users')
+@click.argument('source', type=click.File('r'))
+@click.option('--format', 'import_format', type=click.Choice(IMPORT_FORMATS),
+              help='Guessed from the file extension by default.')
+@click.option('--batch-size', default=5000, show_default=True,
+              help='Users copied per transaction.')
+@click.option('--workers', type=int,
+              help='Password hashing processes, one per CPU by default.')
+def import_users_command(source, import_format: str, batch_size: int,
+                         workers: int):
+    if not import_format:
+        import_format = 'ndjson' if source.name.endswith(
+            ('.ndjson', '.jsonl')) else 'csv'
+    stats = import_users(read_users(source, import_format), batch_size,
+                         workers)
+    print(f'{stats.imported} users imported, '
+          f'{stats.duplicates} duplicates and {stats.invalid} invalid '
+          f'rows skipped')
+
+
+# Rebuilds the filters of the existing logins and emails, needed once
+# before they are used and whenever their capacity setting changes:
+# flask manage rebuild-user-filters
+#
+# Users created meanwhile are added to the new filters as well.
+
+@commands.cli.command('rebuild-user-filters')
+def rebuild_user_filters_command():
+    logins, emails = rebuild_user_filters()
+    print(f'{logins} logins and {emails} emails added to the filters')
@@ -0,0 +1,70 @@
+from typing import Iterable, Optional
+
+from core.settings import config
+from db.redis_client import redis
+from redis.client import Pipeline
+
+# Fill KEYS[2] only if the generation in KEYS[1] is still ARGV[1], the one
+# read before the data (empty when there was none), and KEYS[3], if any,
+# still holds ARGV[4]. ARGV[3] tells how: 'set' to ARGV[5], 'hash' to add
+# the ARGV[5..] field/value pairs, 'reset' to replace the hash with them.
+# Expires in ARGV[2] seconds
+FILL_SCRIPT = """
+if (redis.call('GET', KEYS[1]) or '') ~= ARGV[1] then
+    return 0
+end
+if KEYS[3] and (redis.call('GET', KEYS[3]) or '') ~= ARGV[4] then
+    return 0
+end
+if ARGV[3] == 'set' then
+    redis.call('SET', KEYS[2], ARGV[5], 'EX', ARGV[2])
+    return 1
+end
+if ARGV[3] == 'reset' then
+    redis.call('DEL', KEYS[2])
+end
+for i = 5, #ARGV, 2 do
+    redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+"""
+
+_fill = redis.register_script(FILL_SCRIPT)
+
+
+def generation_key(user_id) -> str:
+    """Bumped on every change of the roles or permissions of the user.
+
+    Data read from Postgres is only cached if the generation read before
+    it is still the current one, so a fill racing with a change can't put
+    back the stale data the change has just dropped. """
+    return f'cache_gen:{user_id}'
+
+
+def bump_generations(pipe: Pipeline, user_ids: Iterable[str]) -> None:
+    for user_id in user_ids:
+        pipe.incr(generation_key(user_id))
+        pipe.expire(generation_key(user_id), config.cache_time)
+
+
+def fill(pipe: Pipeline, user_id, generation: Optional[bytes], key: str,
+         value: str = None, fields: dict = None, reset: bool = False,
+         condition: tuple[str, Optional[bytes]] = None) -> None:
+    """Queue the write of the value, or the hash fields, to the key
+    unless the generation of the user has changed since it was read, or
+    the key of the condition no longer holds the value read along."""
+    if value is not None:
+        mode, values = 'set', [value]
+    else:
+        mode = 'reset' if reset else 'hash'
+        values = [item for field in fields.items() for item in field]
+    keys = [generation_key(user_id), key]
+    expected = b''
+    if condition:
+        condition_key, expected = condition
+        keys.append(condition_key)
+    _fill(keys=keys,
+          args=[generation or b'', config.cache_time, mode, expected or b'',
+                *values],
+          client=pipe)
@@ -0,0 +1,74 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from core.metrics import metrics
+from core.settings import config
+from gevent import monkey
+from gevent.threadpool import ThreadPool
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HashingPoolBusy(Exception):
+    """Too many password hashes are already waiting for the pool."""
+
+
+class PasswordHasher:
+    """Run the CPU-bound password hashing off the gevent hub.
+
+    PBKDF2 releases the GIL, so hashes run in real threads in parallel
+    with the greenlets serving other requests: in gevent's native thread
+    pool under the gevent server, in a thread pool executor otherwise.
+    At most ``pool_size`` hashes run at once and ``queue_size`` more
+    wait for a thread; beyond that callers wait up to ``timeout`` seconds
+    and get HashingPoolBusy, instead of queueing without bound. """
+
+    def __init__(self, pool_size: int, queue_size: int, timeout: float):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(pool_size + queue_size)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                if monkey.is_module_patched('threading'):
+                    self._pool = ThreadPool(self.pool_size)
+                else:
+                    self._pool = ThreadPoolExecutor(self.pool_size)
+            return self._pool
+
+    def _run(self, func: Callable, *args):
+        queued_at = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            metrics.incr('password_hashing.rejected')
+            raise HashingPoolBusy()
+        try:
+            def timed():
+                started_at = time.perf_counter()
+                return func(*args), started_at, time.perf_counter()
+
+            pool = self._get_pool()
+            if isinstance(pool, ThreadPoolExecutor):
+                result, started_at, done_at = pool.submit(timed).result()
+            else:
+                result, started_at, done_at = pool.spawn(timed).get()
+        finally:
+            self._slots.release()
+        # Recorded by the caller: the metrics lock is a gevent one
+        metrics.observe('password_hashing.queue_wait', started_at - queued_at)
+        metrics.observe('password_hashing.hash_time', done_at - started_at)
+        return result
+
+    def generate(self, password: str) -> str:
+        return self._run(generate_password_hash, password)
+
+    def check(self, password_hash: str, password: str) -> bool:
+        return self._run(check_password_hash, password_hash, password)
+
+
+password_hasher = PasswordHasher(config.password_hashing_pool_size,
+                                 config.password_hashing_queue_size,
+                                 config.password_hashing_timeout)
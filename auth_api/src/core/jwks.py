@@ -0,0 +1,48 @@
+import json
+from hashlib import sha256
+
+from core.settings import config
+from flask import Flask
+from jwt.algorithms import get_default_algorithms
+from jwt.utils import base64url_encode
+
+# The ones PyJWT 2.3 can export as a JWK, its EC keys can't be
+ASYMMETRIC_ALGORITHMS = ('RS256', 'RS384', 'RS512',
+                         'PS256', 'PS384', 'PS512', 'EdDSA')
+
+# Members of a public JWK hashed into its RFC 7638 thumbprint
+THUMBPRINT_MEMBERS = ('crv', 'e', 'kty', 'n', 'x', 'y')
+
+
+def uses_asymmetric_signing() -> bool:
+    """Tokens are signed with a private key and verifiable by other
+    services with the public key published as a JWKS."""
+    return config.jwt_algorithm in ASYMMETRIC_ALGORITHMS
+
+
+def key_id(jwk: dict) -> str:
+    members = {k: jwk[k] for k in THUMBPRINT_MEMBERS if k in jwk}
+    thumbprint = json.dumps(members, separators=(',', ':'), sort_keys=True)
+    return base64url_encode(sha256(thumbprint.encode()).digest()).decode()
+
+
+def build_jwks(public_key: str) -> dict:
+    algorithm = get_default_algorithms()[config.jwt_algorithm]
+    jwk = json.loads(algorithm.to_jwk(algorithm.prepare_key(public_key)))
+    jwk.update(kid=key_id(jwk), alg=config.jwt_algorithm, use='sig')
+    return {'keys': [jwk]}
+
+
+def init_signing_keys(app: Flask) -> None:
+    """Configure Flask-JWT-Extended with the secret or the key pair."""
+    app.config['JWT_ALGORITHM'] = config.jwt_algorithm
+    if not uses_asymmetric_signing():
+        app.config['JWT_SECRET_KEY'] = config.jwt_secret_key
+        app.config['JWKS'] = {'keys': []}
+        return
+
+    with open(config.jwt_private_key_path) as key_file:
+        app.config['JWT_PRIVATE_KEY'] = key_file.read()
+    with open(config.jwt_public_key_path) as key_file:
+        app.config['JWT_PUBLIC_KEY'] = key_file.read()
+    app.config['JWKS'] = build_jwks(app.config['JWT_PUBLIC_KEY'])
@@ -0,0 +1,184 @@
+import math
+import uuid
+from functools import wraps
+from http import HTTPStatus
+from typing import NamedTuple, Optional
+
+from core.settings import config
+from db.redis_client import deferred_redis, redis
+from flask import Response, jsonify, make_response, request
+
+# Token bucket holding up to ARGV[1] tokens, refilled with ARGV[2] tokens
+# per second and taking one token per request. The clock is the one of
+# Redis, so every worker sees the same time. Returns whether the request
+# is allowed, the tokens left, the milliseconds until the next token and
+# until the bucket is full again.
+TOKEN_BUCKET_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+local reset = math.ceil((capacity - tokens) / rate * 1000)
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], reset + 1000)
+local retry_after = 0
+if allowed == 0 then
+    retry_after = math.ceil((1 - tokens) / rate * 1000)
+end
+return {allowed, math.floor(tokens), retry_after, reset}
+"""
+
+# Sorted set of the requests in flight scored by their start time, the
+# ones older than the lease (ARGV[3] seconds) are dropped so a worker dying
+# mid-request doesn't hold its slot forever.
+CONCURRENCY_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local limit = tonumber(ARGV[1])
+local lease = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - lease)
+local in_flight = redis.call('ZCARD', KEYS[1])
+if in_flight >= limit then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return {0, 0, math.ceil((tonumber(oldest[2]) + lease - now) * 1000)}
+end
+redis.call('ZADD', KEYS[1], now, ARGV[2])
+redis.call('EXPIRE', KEYS[1], lease)
+return {1, limit - in_flight - 1, 0}
+"""
+
+_take_token = redis.register_script(TOKEN_BUCKET_SCRIPT)
+_acquire_slot = redis.register_script(CONCURRENCY_SCRIPT)
+
+
+class LimitDecision(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    # Seconds until a request would be allowed and until the limit resets
+    retry_after: int = 0
+    reset: int = 0
+
+    def headers(self) -> dict:
+        headers = {'X-RateLimit-Limit': str(self.limit),
+                   'X-RateLimit-Remaining': str(self.remaining),
+                   'X-RateLimit-Reset': str(self.reset)}
+        if not self.allowed:
+            headers['Retry-After'] = str(self.retry_after)
+        return headers
+
+
+def take_token(key: str, capacity: int, period: float) -> LimitDecision:
+    """Take a token from the bucket refilled with capacity tokens
+    per period of seconds, in a single round trip."""
+    allowed, remaining, retry_after, reset = _take_token(
+        keys=[key], args=[capacity, capacity / period])
+    return LimitDecision(bool(allowed), capacity, remaining,
+                         math.ceil(retry_after / 1000),
+                         math.ceil(reset / 1000))
+
+
+def acquire_slot(key: str, limit: int, request_id: str,
+                 lease: int) -> LimitDecision:
+    """Hold one of the limit slots until ``release_slot`` or the lease
+    runs out, in a single round trip."""
+    allowed, remaining, retry_after = _acquire_slot(
+        keys=[key], args=[limit, request_id, lease])
+    return LimitDecision(bool(allowed), limit, remaining,
+                         math.ceil(retry_after / 1000))
+
+
+def release_slot(key: str, request_id: str) -> None:
+    # Sent along with the other writes of the request
+    with deferred_redis() as pipe:
+        pipe.zrem(key, request_id)
+
+
+def _limit_key(prefix: str, user_id: Optional[str], per_user: bool,
+               per_route: bool) -> str:
+    parts = [prefix]
+    if per_route:
+        parts.append(request.endpoint)
+    if per_user:
+        parts.append(user_id)
+    return ':'.join(parts)
+
+
+def too_many_requests(decision: LimitDecision) -> Response:
+    response = make_response(
+        jsonify(error_code='TOO_MANY_REQUESTS',
+                message='API rate limit exceeded'),
+        HTTPStatus.TOO_MANY_REQUESTS
+    )
+    response.headers.update(decision.headers())
+    return response
+
+
+def rate_limit(max_rate: int, period: float = None, per_user: bool = True,
+               per_route: bool = False):
+    """Allow bursts of max_rate requests, refilled over the period
+    (USER_REQUEST_RATE_PERIOD seconds by default). The limit is shared
+    by the routes of a user, kept per route with per_route, and shared
+    by all the users of the route without per_user. The API routes are
+    limited per user and per route."""
+    period = period or config.user_request_rate_period
+
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            # Only imposing per-user limits on user-identified requests
+            if per_user and 'user_id' not in kwargs:
+                return fn(*args, **kwargs)  # pragma: no cover
+
+            key = _limit_key('rate', kwargs.get('user_id'), per_user,
+                             per_route)
+            decision = take_token(key, max_rate, period)
+            if not decision.allowed:
+                return too_many_requests(decision)
+            response = make_response(fn(*args, **kwargs))
+            response.headers.update(decision.headers())
+            return response
+
+        return decorator
+
+    return wrapper
+
+
+def concurrency_limit(max_requests: int, lease: int = None,
+                      per_user: bool = True, per_route: bool = False):
+    """Allow at most max_requests requests in flight at once, scoped
+    like ``rate_limit``. A slot not released within the lease
+    (CONCURRENCY_LEASE seconds by default) is freed anyway."""
+    lease = lease or config.concurrency_lease
+
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            if per_user and 'user_id' not in kwargs:
+                return fn(*args, **kwargs)  # pragma: no cover
+
+            key = _limit_key('in_flight', kwargs.get('user_id'), per_user,
+                             per_route)
+            request_id = uuid.uuid4().hex
+            decision = acquire_slot(key, max_requests, request_id, lease)
+            if not decision.allowed:
+                return too_many_requests(decision)
+            try:
+                response = make_response(fn(*args, **kwargs))
+            finally:
+                release_slot(key, request_id)
+            response.headers.update(decision.headers())
+            return response
+
+        return decorator
+
+    return wrapper
@@ -0,0 +1,42 @@
+import threading
+from typing import Callable
+
+
+class Metrics:
+    """Process-wide counters, gauges and timings of the worker.
+
+    Counters and timings are accumulated in memory, gauges are callables
+    evaluated when a snapshot is taken (see ``GET /api/v1/metrics``). """
+
+    def __init__(self):
+        self._counters: dict[str, int] = {}
+        self._timings: dict[str, dict] = {}
+        self._gauges: dict[str, Callable[[], float]] = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            timing = self._timings.setdefault(
+                name, {'count': 0, 'total': 0.0, 'max': 0.0})
+            timing['count'] += 1
+            timing['total'] += seconds
+            timing['max'] = max(timing['max'], seconds)
+
+    def gauge(self, name: str, getter: Callable[[], float]) -> None:
+        self._gauges[name] = getter
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            result = dict(self._counters)
+            for name, timing in self._timings.items():
+                result[name] = dict(timing)
+        for name, getter in self._gauges.items():
+            result[name] = getter()
+        return result
+
+
+metrics = Metrics()
@@ -0,0 +1,69 @@
+from core.settings import config
+from db.redis_client import deferred_redis, redis
+
+ROTATED = 1
+UNKNOWN = 0
+REUSED = -1
+
+# Swap the current token of the family if the presented one is current,
+# revoke the whole family if an already rotated token is presented again.
+# A revoked family is kept until its latest token expires, so none of its
+# tokens is ever looked up in Postgres again. The new access token, if
+# given in KEYS[2], is made usable for ARGV[4] seconds along the rotation
+ROTATE_SCRIPT = """
+local family = redis.call('HMGET', KEYS[1], 'jti', 'revoked')
+if not family[1] then
+    return 0
+end
+if family[2] or family[1] ~= ARGV[1] then
+    redis.call('HSET', KEYS[1], 'revoked', 1)
+    return -1
+end
+redis.call('HSET', KEYS[1], 'jti', ARGV[2])
+redis.call('EXPIREAT', KEYS[1], ARGV[3])
+if KEYS[2] then
+    redis.call('SET', KEYS[2], '', 'EX', ARGV[4])
+end
+return 1
+"""
+
+_rotate = redis.register_script(ROTATE_SCRIPT)
+
+
+def family_key(family: str) -> str:
+    return f'refresh_family:{family}'
+
+
+def start_refresh_family(claims: dict) -> None:
+    """Make the refresh token the current one of its family.
+
+    Every refresh token descends from the one issued on login through
+    rotations, the family only remembers the jti of the latest one. """
+    key = family_key(claims['fam'])
+    with deferred_redis() as pipe:
+        pipe.hset(key, mapping={'jti': claims['jti'],
+                                'user_id': claims['user_id']})
+        pipe.expireat(key, claims['exp'])
+
+
+def rotate_refresh_family(claims: dict, new_claims: dict,
+                          access_token: str) -> int:
+    """Replace the presented refresh token with the new one in a single
+    round trip, registering the new access token along in allowlist mode.
+    Returns ROTATED, REUSED or UNKNOWN for families missing from Redis,
+    e.g. issued before families were kept there. """
+    keys = [family_key(claims['fam'])]
+    if config.token_revocation_mode == 'allowlist':
+        keys.append(access_token)
+    return _rotate(keys=keys,
+                   args=[claims['jti'], new_claims['jti'], new_claims['exp'],
+                         config.access_token_expiration])
+
+
+def end_refresh_family(claims: dict) -> None:
+    """Revoke the family, kept in Redis until the token expires."""
+    if 'fam' in claims:
+        key = family_key(claims['fam'])
+        with deferred_redis() as pipe:
+            pipe.hset(key, mapping={'jti': claims['jti'], 'revoked': 1})
+            pipe.expireat(key, claims['exp'])
@@ -0,0 +1,207 @@
+import threading
+import time
+from typing import Optional
+
+from core.bloom import BloomFilter
+from core.cache import TOKEN_NAMESPACE, invalidation, token_cache
+from core.refresh_tokens import family_key
+from core.settings import config
+from db.redis_client import deferred_redis, redis
+from flask_jwt_extended import decode_token
+from redis import RedisError
+
+REVOKED_NAMESPACE = 'revoked'
+REVOKED_KEY = 'revoked_tokens'
+
+# Revoke the refresh token family in KEYS[1] if ARGV[1] is its current
+# token, then the access token: deleted from the allowlist when ARGV[2] is
+# 'allowlist' (KEYS[2] is the token), otherwise added to the denylist
+# (KEYS[2] is the set) with the jti ARGV[3] scored by its exp ARGV[4] and
+# the jtis expired by ARGV[5] dropped. ARGV[7] is published to the
+# invalidation channel ARGV[6]. Returns 1 once done, -1 when the refresh
+# token is not the current one and 0, doing nothing, for families missing
+# from Redis
+LOGOUT_SCRIPT = """
+local family = redis.call('HMGET', KEYS[1], 'jti', 'revoked')
+if not family[1] then
+    return 0
+end
+if family[2] or family[1] ~= ARGV[1] then
+    return -1
+end
+redis.call('HSET', KEYS[1], 'revoked', 1)
+if ARGV[2] == 'allowlist' then
+    redis.call('DEL', KEYS[2])
+else
+    redis.call('ZADD', KEYS[2], ARGV[4], ARGV[3])
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[5])
+end
+redis.call('PUBLISH', ARGV[6], ARGV[7])
+return 1
+"""
+
+_logout = redis.register_script(LOGOUT_SCRIPT)
+
+
+class RevocationList:
+    """Denylist of revoked access token jtis.
+
+    Redis keeps the jtis in a sorted set scored by the token exp, so only
+    revoked tokens cost memory and only until they expire. Each worker
+    mirrors the set in a Bloom filter to answer "not revoked" without a
+    network hop; new revocations reach the filter over the invalidation
+    channel and it is dropped whenever the channel is not listened to. """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._filter = None
+        self._building = None
+        self._loaded_at = 0.0
+        # Bumped whenever the channel is lost, a rebuild started before
+        # may have missed revocations and is thrown away
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def enable(self) -> None:
+        """(Re)build the filter from the revoked tokens still alive.
+
+        Jtis revoked while the set is scanned are added to both filters,
+        the scan alone could miss them. """
+        bloom = BloomFilter(self.capacity)
+        with self._lock:
+            if self._building is not None:
+                # Another rebuild is running and will see the same jtis
+                return
+            self._building = bloom
+            epoch = self._epoch
+        try:
+            now = time.time()
+            redis.zremrangebyscore(REVOKED_KEY, '-inf', now)
+            for jti, _ in redis.zscan_iter(REVOKED_KEY):
+                bloom.add(jti.decode())
+        except RedisError:
+            with self._lock:
+                if self._building is bloom:
+                    self._building = None
+            raise
+        with self._lock:
+            if self._epoch != epoch:
+                return
+            self._filter = bloom
+            self._building = None
+            self._loaded_at = now
+
+    def disable(self) -> None:
+        with self._lock:
+            self._epoch += 1
+            self._filter = None
+            self._building = None
+
+    def invalidate(self, jti: str) -> None:
+        with self._lock:
+            for bloom in (self._filter, self._building):
+                if bloom is not None:
+                    bloom.add(jti)
+
+    def _rebuild_in_background(self) -> None:
+        with self._lock:
+            if self._building is not None:
+                return
+        threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def _rebuild(self) -> None:
+        try:
+            self.enable()
+        except RedisError:
+            # The current filter is kept and the rebuild retried later
+            pass
+
+    def revoke(self, jti: str, exp: int) -> None:
+        with deferred_redis() as pipe:
+            pipe.zadd(REVOKED_KEY, {jti: exp})
+            pipe.zremrangebyscore(REVOKED_KEY, '-inf', time.time())
+        invalidation.publish(REVOKED_NAMESPACE, jti)
+
+    def is_revoked(self, jti: str) -> bool:
+        bloom = self._filter
+        if bloom is not None and jti not in bloom:
+            return False
+        # Expired jtis are never removed from the filter, rebuild it
+        # once they all had time to expire to keep false positives rare,
+        # off the request path
+        if (bloom is not None and time.time() - self._loaded_at
+                > config.access_token_expiration):
+            self._rebuild_in_background()
+        return redis.zscore(REVOKED_KEY, jti) is not None
+
+
+revocation_list = RevocationList(config.revocation_filter_capacity)
+if config.token_revocation_mode == 'denylist':
+    invalidation.register(REVOKED_NAMESPACE, revocation_list)
+
+
+def register_access_token(access_token: str) -> None:
+    """Make a newly issued access token usable."""
+    if config.token_revocation_mode == 'allowlist':
+        with deferred_redis() as pipe:
+            pipe.set(name=access_token,
+                     value='',
+                     ex=config.access_token_expiration)
+
+
+def is_access_token_active(access_token: str, claims: dict) -> bool:
+    """Check that the access token was neither revoked nor expired."""
+    jti = claims.get('jti')
+    if config.token_revocation_mode == 'denylist':
+        return not revocation_list.is_revoked(jti)
+
+    # Tokens verified recently by this worker skip the Redis hop,
+    # revocation evicts them from every worker through pub/sub
+    if jti and token_cache.get(jti):
+        return True
+    # Not cached if the token was revoked while Redis was asked
+    version = token_cache.version()
+    if not redis.get(access_token) == b'':
+        return False
+    if jti:
+        token_cache.set(jti, True, expires_at=claims['exp'], version=version)
+    return True
+
+
+def revoke_access_token(access_token: str) -> None:
+    claims = decode_token(access_token)
+    if config.token_revocation_mode == 'denylist':
+        revocation_list.revoke(claims['jti'], claims['exp'])
+        return
+
+    with deferred_redis() as pipe:
+        pipe.delete(access_token)
+    # Evict the access token from the workers' verification caches
+    invalidation.publish(TOKEN_NAMESPACE, claims['jti'])
+
+
+def end_session(access_token: str, refresh_claims: dict) -> Optional[bool]:
+    """Revoke the refresh token family and the access token in a single
+    round trip if the refresh token is the current one of its family.
+
+    None, with nothing revoked, when the family is unknown to Redis; the
+    caller checks the refresh token in Postgres and revokes the tokens
+    with ``end_refresh_family`` and ``revoke_access_token`` instead. """
+    if 'fam' not in refresh_claims:
+        return None
+    claims = decode_token(access_token)
+    mode = config.token_revocation_mode
+    if mode == 'allowlist':
+        token_key, namespace = access_token, TOKEN_NAMESPACE
+    else:
+        token_key, namespace = REVOKED_KEY, REVOKED_NAMESPACE
+    ended = _logout(
+        keys=[family_key(refresh_claims['fam']), token_key],
+        args=[refresh_claims['jti'], mode, claims['jti'], claims['exp'],
+              time.time(), invalidation.channel,
+              invalidation.message(namespace, claims['jti'])])
+    if ended == 0:
+        return None
+    if ended == 1:
+        invalidation.invalidate_locally(namespace, claims['jti'])
+    return ended == 1
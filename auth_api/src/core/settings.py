@@ -1,4 +1,5 @@
 import os
+from typing import Literal, Optional
 
 from pydantic import BaseSettings
 
@@ -19,8 +20,25 @@ class AppSettings(BaseSettings):
     service_admin_role: str
     access_token_expiration: int
     jwt_secret_key: str
+    jwt_algorithm: Literal['HS256', 'HS384', 'HS512',
+                           'RS256', 'RS384', 'RS512',
+                           'PS256', 'PS384', 'PS512', 'EdDSA']
+    jwt_private_key_path: Optional[str]
+    jwt_public_key_path: Optional[str]
+    jwt_embed_permissions: bool
     cache_time: int
     user_max_request_rate: int
+    user_request_rate_period: float
+    user_max_concurrent_requests: int
+    concurrency_lease: int
+    preauth_ip_max_attempts: int
+    preauth_login_max_attempts: int
+    preauth_attempts_period: float
+    preauth_sync_interval: float
+    preauth_throttle_size: int
+    trusted_proxies: int
+    user_filter_capacity: int
+    user_filter_error_rate: float
     oauth_vk_id: str
     oauth_vk_secret: str
     vk_api_version: str
@@ -29,6 +47,20 @@ class AppSettings(BaseSettings):
     jaeger_service_name: str
     jaeger_agent_host: str
     jaeger_agent_port: int
+    token_cache_size: int
+    perms_cache_size: int
+    cache_invalidation_channel: str
+    token_revocation_mode: Literal['allowlist', 'denylist']
+    revocation_filter_capacity: int
+    write_behind_queue_size: int
+    write_behind_batch_size: int
+    write_behind_flush_interval: float
+    token_reaper_interval: float
+    token_reaper_batch_size: int
+    token_reaper_pause: float
+    password_hashing_pool_size: int
+    password_hashing_queue_size: int
+    password_hashing_timeout: float
 
 
 app_settings = {
@@ -47,8 +79,24 @@ app_settings = {
     'service_admin_role': os.getenv('SERVICE_ADMIN_ROLE'),
     'access_token_expiration': os.getenv('ACCESS_TOKEN_EXPIRATION'),
     'jwt_secret_key': os.getenv('JWT_SECRET_KEY'),
+    'jwt_algorithm': os.getenv('JWT_ALGORITHM', 'HS256'),
+    'jwt_private_key_path': os.getenv('JWT_PRIVATE_KEY_PATH'),
+    'jwt_public_key_path': os.getenv('JWT_PUBLIC_KEY_PATH'),
+    'jwt_embed_permissions': os.getenv('JWT_EMBED_PERMISSIONS', False),
     'cache_time': os.getenv('CACHE_TIME'),
     'user_max_request_rate': os.getenv('USER_MAX_REQUEST_RATE'),
+    'user_request_rate_period': os.getenv('USER_REQUEST_RATE_PERIOD', 1),
+    'user_max_concurrent_requests': os.getenv('USER_MAX_CONCURRENT_REQUESTS',
+                                              10),
+    'concurrency_lease': os.getenv('CONCURRENCY_LEASE', 60),
+    'preauth_ip_max_attempts': os.getenv('PREAUTH_IP_MAX_ATTEMPTS', 30),
+    'preauth_login_max_attempts': os.getenv('PREAUTH_LOGIN_MAX_ATTEMPTS', 10),
+    'preauth_attempts_period': os.getenv('PREAUTH_ATTEMPTS_PERIOD', 60),
+    'preauth_sync_interval': os.getenv('PREAUTH_SYNC_INTERVAL', 1),
+    'preauth_throttle_size': os.getenv('PREAUTH_THROTTLE_SIZE', 100000),
+    'trusted_proxies': os.getenv('TRUSTED_PROXIES', 0),
+    'user_filter_capacity': os.getenv('USER_FILTER_CAPACITY', 1000000),
+    'user_filter_error_rate': os.getenv('USER_FILTER_ERROR_RATE', 0.01),
     'oauth_vk_id': os.getenv('OAUTH_VK_ID'),
     'oauth_vk_secret': os.getenv('OAUTH_VK_SECRET'),
     'vk_api_version': os.getenv('VK_API_VERSION'),
@@ -56,6 +104,24 @@ app_settings = {
     'oauth_ydx_secret': os.getenv('OAUTH_YDX_SECRET'),
     'jaeger_service_name': os.getenv('JAEGER_SERVICE_NAME'),
     'jaeger_agent_host': os.getenv('JAEGER_AGENT_HOST'),
-    'jaeger_agent_port': os.getenv('JAEGER_AGENT_PORT')
+    'jaeger_agent_port': os.getenv('JAEGER_AGENT_PORT'),
+    'token_cache_size': os.getenv('TOKEN_CACHE_SIZE', 10000),
+    'perms_cache_size': os.getenv('PERMS_CACHE_SIZE', 10000),
+    'cache_invalidation_channel': os.getenv('CACHE_INVALIDATION_CHANNEL',
+                                            'cache:invalidate'),
+    'token_revocation_mode': os.getenv('TOKEN_REVOCATION_MODE', 'allowlist'),
+    'revocation_filter_capacity': os.getenv('REVOCATION_FILTER_CAPACITY',
+                                            1000000),
+    'write_behind_queue_size': os.getenv('WRITE_BEHIND_QUEUE_SIZE', 10000),
+    'write_behind_batch_size': os.getenv('WRITE_BEHIND_BATCH_SIZE', 500),
+    'write_behind_flush_interval': os.getenv('WRITE_BEHIND_FLUSH_INTERVAL',
+                                             0.5),
+    'token_reaper_interval': os.getenv('TOKEN_REAPER_INTERVAL', 0),
+    'token_reaper_batch_size': os.getenv('TOKEN_REAPER_BATCH_SIZE', 500),
+    'token_reaper_pause': os.getenv('TOKEN_REAPER_PAUSE', 0.1),
+    'password_hashing_pool_size': os.getenv('PASSWORD_HASHING_POOL_SIZE', 4),
+    'password_hashing_queue_size': os.getenv('PASSWORD_HASHING_QUEUE_SIZE',
+                                             64),
+    'password_hashing_timeout': os.getenv('PASSWORD_HASHING_TIMEOUT', 5)
 }
 config = AppSettings.parse_obj(app_settings)
@@ -0,0 +1,128 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Optional
+
+from core.limits import LimitDecision, too_many_requests
+from core.settings import config
+from db.redis_client import redis
+from flask import request
+from redis import RedisError
+
+
+class PreAuthThrottle:
+    """Token buckets of the clients of the unauthenticated routes.
+
+    The buckets live in the worker, so attempts cost neither a Redis nor
+    a Postgres round trip. The attempts let through are summed in Redis
+    off the request path by ``sync_throttles_periodically`` in counters
+    of fixed windows of ``period`` seconds: a client over the limit
+    across all the workers is blocked by each of them until the end of
+    the window. """
+
+    def __init__(self, namespace: str, capacity: int, period: float,
+                 maxsize: int):
+        self.namespace = namespace
+        self.capacity = capacity
+        self.period = period
+        self.maxsize = maxsize
+        self._buckets: OrderedDict = OrderedDict()
+        self._pending: dict[str, int] = {}
+        self._blocked: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key: str) -> LimitDecision:
+        """Take a token of the client, if the cluster hasn't blocked it."""
+        now = time.time()
+        rate = self.capacity / self.period
+        with self._lock:
+            blocked_until = self._blocked.get(key, 0)
+            if blocked_until > now:
+                return LimitDecision(False, self.capacity, 0,
+                                     math.ceil(blocked_until - now))
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+                self._pending[key] = self._pending.get(key, 0) + 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return LimitDecision(allowed, self.capacity, int(tokens),
+                             math.ceil((1 - tokens) / rate) if not allowed
+                             else 0)
+
+    def sync(self) -> None:
+        """Add the attempts of the worker to the counters of the cluster
+        and block the clients over the limit, in a single round trip."""
+        now = time.time()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._blocked = {key: until for key, until
+                             in self._blocked.items() if until > now}
+        if not pending:
+            return
+        window = int(now // self.period)
+        pipe = redis.pipeline(transaction=False)
+        for key, attempts in pending.items():
+            counter = f'{self.namespace}:{key}:{window}'
+            pipe.incrby(counter, attempts)
+            pipe.expire(counter, math.ceil(self.period))
+        try:
+            totals = pipe.execute()[::2]
+        except RedisError:
+            # Throttled by the worker alone until Redis is back
+            with self._lock:
+                for key, attempts in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + attempts
+            return
+        window_end = (window + 1) * self.period
+        with self._lock:
+            for key, total in zip(pending, totals):
+                if total > self.capacity:
+                    self._blocked[key] = window_end
+
+
+ip_throttle = PreAuthThrottle('preauth_ip', config.preauth_ip_max_attempts,
+                              config.preauth_attempts_period,
+                              config.preauth_throttle_size)
+login_throttle = PreAuthThrottle('preauth_login',
+                                 config.preauth_login_max_attempts,
+                                 config.preauth_attempts_period,
+                                 config.preauth_throttle_size)
+
+
+def sync_throttles_periodically(interval: float) -> None:
+    """Loop of the throttles sync run alongside the gevent server."""
+    while True:
+        time.sleep(interval)
+        for throttle in (ip_throttle, login_throttle):
+            throttle.sync()
+
+
+def _requested_login() -> Optional[str]:
+    body = request.get_json(silent=True)
+    username = body.get('username') if isinstance(body, dict) else None
+    return username.strip().lower() if isinstance(username, str) else None
+
+
+def preauth_throttle(by_login: bool = False):
+    """Throttle the attempts of the client IP and, with by_login, the
+    attempts on the username of the request, before any work is done."""
+    def wrapper(fn):
+        @wraps(fn)
+        def decorator(*args, **kwargs):
+            decision = ip_throttle.hit(request.remote_addr or '')
+            login = _requested_login() if by_login else None
+            if decision.allowed and login:
+                decision = login_throttle.hit(login)
+            if not decision.allowed:
+                return too_many_requests(decision)
+            return fn(*args, **kwargs)
+
+        return decorator
+
+    return wrapper
@@ -4,10 +4,12 @@ from functools import wraps
 from http import HTTPStatus
 
 import opentracing
+from core.revocation import is_access_token_active
 from core.tracer import tracer
-from db.redis_client import redis
-from flask import jsonify, make_response, request
-from flask_jwt_extended import get_jwt
+from flask import has_request_context, jsonify, make_response, request
+from flask_jwt_extended import get_jwt, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
 from pydantic import ValidationError
 
 
@@ -41,15 +43,15 @@ def authenticate():
         @wraps(fn)
         def decorator(*args, **kwargs):
             access_token = request.headers['Authorization'].split().pop(-1)
+            jwt = get_jwt()
 
-            if not redis.get(access_token) == b'':
+            if not is_access_token_active(access_token, jwt):
                 return make_response(
                     jsonify(error_code='ACCESS_TOKEN_EXPIRED',
                             message='Access token has expired'),
                     HTTPStatus.UNAUTHORIZED
                 )
 
-            jwt = get_jwt()
             if 'user_id' not in jwt:
                 return make_response(
                     jsonify(error_mode='IDENTITY_MISSING',
@@ -64,30 +66,21 @@ def authenticate():
     return wrapper
 
 
-def rate_limit(max_rate):
-    def wrapper(fn):
-        @wraps(fn)
-        def decorator(*args, **kwargs):
-            # Only imposing the limits on user-identified requests
-            if 'user_id' not in kwargs:
-                return fn(*args, **kwargs)  # pragma: no cover
-
-            key = f"buffer:{kwargs['user_id']}"
-            buffer_size = redis.incr(key, 1)
-            if buffer_size > 10:
-                redis.decr(key)
-                return make_response(
-                    jsonify(error_code='TOO_MANY_REQUESTS',
-                            message='API rate limit exceeded'),
-                    HTTPStatus.TOO_MANY_REQUESTS
-                )
-            result = fn(*args, **kwargs)  # pragma: no cover
-            redis.decr(key)
-            return result
-
-        return decorator
-
-    return wrapper
+def get_verified_claims() -> dict:
+    """Claims of the active access token sent with the request, if any."""
+    if not has_request_context():
+        return {}
+    try:
+        verify_jwt_in_request(optional=True)
+    except (JWTExtendedException, PyJWTError):
+        return {}
+    claims = get_jwt()
+    if not claims or claims.get('type') != 'access':
+        return {}
+    access_token = request.headers['Authorization'].split().pop(-1)
+    if not is_access_token_active(access_token, claims):
+        return {}
+    return claims
 
 
 def trace(func):
@@ -0,0 +1,135 @@
+from datetime import date, datetime
+
+from core.settings import config
+from db.pg import db
+from sqlalchemy import text
+
+# Monthly partitions are named <table>_<yyyy>_<mm>,
+# rows outside of them go to <table>_default
+PARTITION_SUFFIX = '%Y_%m'
+
+
+def month_start(day: date, months: int = 0) -> date:
+    """First day of the month of the day, shifted by a number of months."""
+    month = day.year * 12 + day.month - 1 + months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f'{table}_{month.strftime(PARTITION_SUFFIX)}'
+
+
+def is_partitioned(table: str) -> bool:
+    return db.session.execute(text(
+        'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p '
+        'JOIN pg_class c ON c.oid = p.partrelid '
+        'JOIN pg_namespace n ON n.oid = c.relnamespace '
+        'WHERE n.nspname = :schema AND c.relname = :table)'),
+        {'schema': config.pg_schema, 'table': table}).scalar()
+
+
+def list_partitions(table: str) -> list[str]:
+    return db.session.execute(text(
+        'SELECT c.relname FROM pg_inherits i '
+        'JOIN pg_class c ON c.oid = i.inhrelid '
+        'JOIN pg_class parent ON parent.oid = i.inhparent '
+        'JOIN pg_namespace n ON n.oid = parent.relnamespace '
+        'WHERE n.nspname = :schema AND parent.relname = :table '
+        'ORDER BY c.relname'),
+        {'schema': config.pg_schema, 'table': table}).scalars().all()
+
+
+def partition_column(table: str) -> str:
+    """The column the table is partitioned by."""
+    return db.session.execute(text(
+        'SELECT a.attname FROM pg_partitioned_table p '
+        'JOIN pg_class c ON c.oid = p.partrelid '
+        'JOIN pg_namespace n ON n.oid = c.relnamespace '
+        'JOIN pg_attribute a '
+        'ON a.attrelid = c.oid AND a.attnum = p.partattrs[0] '
+        'WHERE n.nspname = :schema AND c.relname = :table'),
+        {'schema': config.pg_schema, 'table': table}).scalar()
+
+
+def create_monthly_partitions(table: str, first: date, last: date) -> None:
+    """Create the missing monthly partitions from the month of the first
+    day to the month of the last one, and the default partition.
+
+    Rows of a month already in the default partition would make creating
+    the partition of the month fail, they are moved to it: the default
+    partition is detached meanwhile, which blocks the writes to the table
+    until the transaction ends. """
+    parent = f'{config.pg_schema}.{table}'
+    db.session.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {parent}_default '
+        f'PARTITION OF {parent} DEFAULT'))
+    existing = set(list_partitions(table))
+    column = None
+    month = month_start(first)
+    while month <= last:
+        upper = month_start(month, 1)
+        name = partition_name(table, month)
+        if name not in existing:
+            column = column or partition_column(table)
+            _create_partition(parent, f'{config.pg_schema}.{name}', column,
+                              month, upper)
+        month = upper
+
+
+def _create_partition(parent: str, partition: str, column: str,
+                      lower: date, upper: date) -> None:
+    default = f'{parent}_default'
+    month_range = {'lower': lower, 'upper': upper}
+    create = (f'CREATE TABLE {partition} PARTITION OF {parent} '
+              f"FOR VALUES FROM ('{lower}') TO ('{upper}')")
+    in_default = db.session.execute(text(
+        f'SELECT EXISTS (SELECT 1 FROM {default} '
+        f'WHERE {column} >= :lower AND {column} < :upper)'),
+        month_range).scalar()
+    if not in_default:
+        db.session.execute(text(create))
+        return
+
+    db.session.execute(text(
+        f'ALTER TABLE {parent} DETACH PARTITION {default}'))
+    db.session.execute(text(create))
+    db.session.execute(text(
+        f'WITH moved AS (DELETE FROM {default} '
+        f'WHERE {column} >= :lower AND {column} < :upper '
+        f'RETURNING *) INSERT INTO {partition} SELECT * FROM moved'),
+        month_range)
+    db.session.execute(text(
+        f'ALTER TABLE {parent} ATTACH PARTITION {default} DEFAULT'))
+
+
+def drop_partitions_before(table: str, before: datetime) -> list[str]:
+    """Drop the monthly partitions only holding rows older than the date,
+    which is a lot cheaper than deleting the rows. """
+    dropped = []
+    for name in list_partitions(table):
+        suffix = name[len(table) + 1:]
+        try:
+            month = datetime.strptime(suffix, PARTITION_SUFFIX).date()
+        except ValueError:
+            # The default partition
+            continue
+        if month_start(month, 1) <= before.date():
+            db.session.execute(text(
+                f'DROP TABLE {config.pg_schema}.{name}'))
+            dropped.append(name)
+    return dropped
+
+
+def maintain_monthly_partitions(table: str, months_ahead: int,
+                                retention_months: int = 0) -> list[str]:
+    """Create the partitions of the coming months and, with a retention
+    period, drop the ones older than it. Returns the dropped ones."""
+    today = date.today()
+    create_monthly_partitions(table, today, month_start(today, months_ahead))
+    dropped = []
+    if retention_months:
+        oldest = month_start(today, -retention_months)
+        dropped = drop_partitions_before(
+            table, datetime.combine(oldest, datetime.min.time()))
+    db.session.commit()
+    return dropped
@@ -1,5 +1,9 @@
+from contextlib import contextmanager
+from typing import Iterator
+
 from core.settings import config
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 
 db = SQLAlchemy()
 
@@ -9,3 +13,20 @@ PG_URI = 'postgresql://{pg_user}:{pg_pass}@{pg_host}/{pg_dbname}'.format(
     pg_host=config.pg_host,
     pg_dbname=config.pg_dbname
 )
+
+
+@contextmanager
+def count_queries() -> Iterator[list[str]]:
+    """Collect the statements sent to Postgres in the block,
+    e.g. to catch N+1 queries."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
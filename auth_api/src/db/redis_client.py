@@ -1,4 +1,47 @@
+from contextlib import contextmanager
+
 from core.settings import config
+from flask import g, has_request_context
 from redis import Redis
+from redis.client import Pipeline
 
 redis = Redis(host=config.redis_host, port=config.redis_port)
+
+
+@contextmanager
+def redis_batch(transaction: bool = False) -> Pipeline:
+    """Send the Redis commands queued in the block in a single round trip,
+    wrapped in MULTI/EXEC when a transaction is requested."""
+    pipe = redis.pipeline(transaction=transaction)
+    yield pipe
+    pipe.execute()
+
+
+@contextmanager
+def deferred_redis() -> Pipeline:
+    """Queue Redis writes whose result the request doesn't need.
+
+    Within a request all of them are sent in one round trip once the
+    response is ready (see ``flush_deferred_redis``), outside of a request
+    they are sent at the end of the block. Nothing is sent when nothing
+    was queued.
+
+    An authenticated request costs up to three round trips: the access
+    token check (skipped when the token is in the worker's cache), the
+    rate limiter script and this flush (skipped when nothing was queued,
+    e.g. on reads). Refresh and logout write through a single script
+    instead of this flush, so a refresh costs one round trip and a logout
+    two along with the limiter. """
+    if not has_request_context():
+        with redis_batch() as pipe:
+            yield pipe
+        return
+    if '_deferred_redis' not in g:
+        g._deferred_redis = redis.pipeline(transaction=False)
+    yield g._deferred_redis
+
+
+def flush_deferred_redis() -> None:
+    pipe = g.pop('_deferred_redis', None)
+    if pipe is not None:
+        pipe.execute()
@@ -0,0 +1,129 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+from core.metrics import metrics
+from core.settings import config
+from core.utils import eprint
+from db.partitions import (create_monthly_partitions, drop_partitions_before,
+                           is_partitioned)
+from db.pg import db
+from flask import Flask
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+TOKENS_TABLE = 'tokens'
+
+# Partitions created in advance of the tokens expiring in them
+PARTITION_MONTHS_AHEAD = 2
+
+
+def _reap_batch_statement():
+    tokens = f'{config.pg_schema}.{TOKENS_TABLE}'
+    # Locked rows are being deleted by a refresh or another reaper
+    return text(
+        f'WITH expired AS ('
+        f'SELECT token_id, expires_at FROM {tokens} '
+        f'WHERE expires_at < now() AND (expires_at, token_id) > '
+        f'(CAST(:after_time AS timestamptz), CAST(:after_id AS uuid)) '
+        f'ORDER BY expires_at, token_id LIMIT :batch_size '
+        f'FOR UPDATE SKIP LOCKED) '
+        f'DELETE FROM {tokens} t USING expired '
+        f'WHERE t.token_id = expired.token_id '
+        f'AND t.expires_at = expired.expires_at '
+        f'RETURNING t.expires_at, t.token_id')
+
+
+def reap_expired_tokens(batch_size: int, pause: float) -> int:
+    """Delete the expired refresh tokens in small transactions walking
+    the (expires_at, token_id) index, pausing between them so the
+    deletes never hold many locks at once. """
+    reaped = 0
+    if is_partitioned(TOKENS_TABLE):
+        now = datetime.now(timezone.utc)
+        for name in drop_partitions_before(TOKENS_TABLE, now):
+            eprint(f'Dropped expired tokens partition {name}')
+        create_monthly_partitions(
+            TOKENS_TABLE, now.date(),
+            now.date() + timedelta(days=31 * PARTITION_MONTHS_AHEAD))
+        db.session.commit()
+
+    statement = _reap_batch_statement()
+    cursor = {'after_time': '-infinity',
+              'after_id': '00000000-0000-0000-0000-000000000000'}
+    while True:
+        rows = db.session.execute(
+            statement, {**cursor, 'batch_size': batch_size}).all()
+        db.session.commit()
+        if not rows:
+            break
+        reaped += len(rows)
+        after_time, after_id = max(rows)
+        cursor = {'after_time': after_time, 'after_id': str(after_id)}
+        time.sleep(pause)
+
+    metrics.incr('token_reaper.reaped', reaped)
+    return reaped
+
+
+def reap_tokens_periodically(app: Flask, interval: float) -> None:
+    """Loop of the reaper run alongside the gevent server."""
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                reap_expired_tokens(config.token_reaper_batch_size,
+                                    config.token_reaper_pause)
+            except SQLAlchemyError as err:
+                db.session.rollback()
+                eprint(f'Expired tokens reaping failed: {err}')
+
+
+def partition_tokens_table() -> int:
+    """Turn the tokens table into monthly partitions by expiry date so the
+    reaper can drop whole partitions. Expired tokens are left behind.
+    Runs in a single transaction, returns the number of tokens copied."""
+    schema = config.pg_schema
+    tokens = f'{schema}.{TOKENS_TABLE}'
+    old_tokens = f'{tokens}_unpartitioned'
+    now = datetime.now(timezone.utc)
+
+    db.session.execute(text(
+        f'ALTER TABLE {tokens} RENAME TO {TOKENS_TABLE}_unpartitioned'))
+    db.session.execute(text(
+        f'CREATE TABLE {tokens} ('
+        f'token_id uuid NOT NULL DEFAULT gen_random_uuid(), '
+        f'token_owner_id uuid NOT NULL, '
+        f'token_value text NOT NULL, '
+        f'token_digest bytea NOT NULL, '
+        f'token_used boolean DEFAULT false, '
+        f'created_at timestamp with time zone DEFAULT (now()), '
+        f'expires_at timestamp with time zone NOT NULL '
+        f'DEFAULT (now()::DATE + 10)'
+        f') PARTITION BY RANGE (expires_at)'))
+
+    last_expiry = db.session.execute(text(
+        f'SELECT max(expires_at) FROM {old_tokens}')).scalar() or now
+    create_monthly_partitions(
+        TOKENS_TABLE, now.date(),
+        max(last_expiry, now).date() + timedelta(
+            days=31 * PARTITION_MONTHS_AHEAD))
+
+    copied = db.session.execute(text(
+        f'INSERT INTO {tokens} SELECT token_id, token_owner_id, token_value, '
+        f'token_digest, token_used, created_at, expires_at '
+        f'FROM {old_tokens} WHERE expires_at >= now()')).rowcount
+    db.session.execute(text(f'DROP TABLE {old_tokens}'))
+
+    # Unique constraints of a partitioned table include the partition key
+    for statement in (
+            f'ALTER TABLE {tokens} ADD PRIMARY KEY (token_id, expires_at)',
+            f'ALTER TABLE {tokens} '
+            f'ADD UNIQUE (token_owner_id, token_digest, expires_at)',
+            f'ALTER TABLE {tokens} ADD FOREIGN KEY (token_owner_id) '
+            f'REFERENCES {schema}.users(user_id) '
+            f'ON DELETE CASCADE ON UPDATE CASCADE',
+            f'CREATE INDEX ON {tokens} USING hash (token_digest)',
+            f'CREATE INDEX ON {tokens} (expires_at, token_id)'):
+        db.session.execute(text(statement))
+    db.session.commit()
+    return copied
@@ -0,0 +1,154 @@
+import queue
+import threading
+import time
+from itertools import groupby
+from typing import Callable
+
+from core.metrics import metrics
+from core.settings import config
+from core.utils import eprint
+from db.pg import db
+from flask import Flask
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
+from sqlalchemy.sql import Executable
+
+# Attempts of a write retried on its own after its batch failed,
+# only connection errors and the like are worth retrying
+WRITE_ATTEMPTS = 3
+RETRY_PAUSE = 0.5
+
+
+class WriteBehindQueue:
+    """Buffer writes that don't need to be on the request path
+    and send them to Postgres in bulk from a background worker.
+
+    A write is a statement with its parameters, consecutive writes of
+    the same statement object are sent as a single executemany. They
+    are only accepted while the worker is running: ``execute`` falls
+    back to the current session in the development server, when the
+    queue is full or during shutdown. """
+
+    def __init__(self, maxsize: int, batch_size: int, flush_interval: float):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize)
+        self._flush_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._app = None
+        self._in_flight: list[tuple[Executable, dict]] = []
+        metrics.gauge('write_behind.queue_depth', self._queue.qsize)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and not self._stopping.is_set()
+
+    def start(self, app: Flask) -> None:
+        self._app = app
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        """Stop accepting writes and flush everything left in the queue."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+        self.drain()
+
+    def put(self, statement: Executable, params: dict) -> bool:
+        if not self.running:
+            return False
+        try:
+            self._queue.put_nowait((statement, params))
+        except queue.Full:
+            metrics.incr('write_behind.rejected')
+            return False
+        metrics.incr('write_behind.queued')
+        return True
+
+    def execute(self, statement: Executable, params: dict) -> None:
+        """Queue the write or run it in the session, left to be committed
+        by the caller."""
+        if not self.put(statement, params):
+            db.session.execute(statement, params)
+
+    def pending(self, statement: Executable,
+                match: Callable[[dict], bool]) -> list[dict]:
+        """Parameters of the writes of the statement not committed yet,
+        for reading own writes without flushing the queue."""
+        with self._queue.mutex:
+            writes = list(self._queue.queue)
+        writes += self._in_flight
+        return [params for queued, params in writes
+                if queued is statement and match(params)]
+
+    def drain(self) -> None:
+        """Flush the queued writes right away, e.g. on shutdown."""
+        batch = self._take(block=False)
+        while batch:
+            self._flush(batch)
+            batch = self._take(block=False)
+
+    def _take(self, block: bool) -> list[tuple[Executable, dict]]:
+        batch = []
+        try:
+            if block:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _flush(self, batch: list[tuple[Executable, dict]]) -> None:
+        with self._flush_lock:
+            self._in_flight = batch
+            try:
+                self._write(batch)
+            except SQLAlchemyError as err:
+                # One bad write must not drop the others of the batch
+                eprint(f'Write-behind flush of {len(batch)} writes failed, '
+                       f'retrying them one by one: {err}')
+                for write in batch:
+                    self._write_one(write)
+            else:
+                metrics.incr('write_behind.flushed', len(batch))
+            finally:
+                self._in_flight = []
+
+    def _write(self, batch: list[tuple[Executable, dict]]) -> None:
+        # executemany of an INSERT is sent by psycopg2
+        # as multi-row INSERTs
+        with db.get_engine(self._app).begin() as conn:
+            for statement, writes in groupby(batch, key=lambda w: w[0]):
+                conn.execute(statement, [p for _, p in writes])
+
+    def _write_one(self, write: tuple[Executable, dict]) -> None:
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                self._write([write])
+                metrics.incr('write_behind.flushed')
+                return
+            except OperationalError as err:
+                error = err
+                if attempt < WRITE_ATTEMPTS:
+                    time.sleep(RETRY_PAUSE * attempt)
+            except SQLAlchemyError as err:
+                error = err
+                break
+        metrics.incr('write_behind.failed')
+        eprint(f'Write-behind write dropped: {error}')
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            batch = self._take(block=True)
+            if batch:
+                self._flush(batch)
+
+
+write_behind = WriteBehindQueue(config.write_behind_queue_size,
+                                config.write_behind_batch_size,
+                                config.write_behind_flush_interval)
@@ -3,13 +3,17 @@ from http import HTTPStatus
 from flask import make_response, jsonify
 
 from api.common import api
+from core.cache import invalidation
 from core.commands import commands
 from core.containers import Container
+from core.jwks import init_signing_keys, uses_asymmetric_signing
 from core.settings import config
 from core.tracer import tracer
 from core.utils import ServiceException
 from db.pg import PG_URI, db
+from db.redis_client import flush_deferred_redis
 from flask_jwt_extended import JWTManager
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 
 def create_app():
@@ -28,13 +32,31 @@ def create_app():
             'secret': config.oauth_ydx_secret
         }
     }
+    if config.trusted_proxies:
+        # Client IPs taken from X-Forwarded-For, e.g. by the pre-auth
+        # throttle, as set by the trusted proxies only
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=config.trusted_proxies)
     db.init_app(app)
     tracer.init_app(app)
     app.register_blueprint(api, url_prefix='/api')
     app.register_blueprint(commands)
 
-    app.config['JWT_SECRET_KEY'] = config.jwt_secret_key
-    JWTManager(app)
+    init_signing_keys(app)
+    jwt_manager = JWTManager(app)
+    if uses_asymmetric_signing():
+        kid = app.config['JWKS']['keys'][0]['kid']
+        jwt_manager.additional_headers_loader(lambda identity: {'kid': kid})
+    invalidation.start()
+
+    @app.after_request
+    def send_deferred_redis(response):
+        flush_deferred_redis()
+        return response
+
+    @app.teardown_request
+    def send_deferred_redis_on_error(exc):
+        flush_deferred_redis()
+
     return app
 
 
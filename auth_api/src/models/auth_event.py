@@ -20,6 +20,8 @@ class AuthEvent(db.Model):
         db.ForeignKey(f'{config.pg_schema}.users.user_id'),
         nullable=False)
     auth_event_type = db.Column(db.String, nullable=False)
+    # Partition key of the table, hence part of the primary key
     auth_event_time = db.Column(db.DateTime(timezone=True),
+                                primary_key=True,
                                 server_default=func.now())
     auth_event_fingerprint = db.Column(db.String, nullable=False)
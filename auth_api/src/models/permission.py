@@ -1,8 +1,10 @@
 from dataclasses import dataclass
+from typing import Optional
+from uuid import UUID as UUID_TYPE
 
 from core.settings import config
 from db.pg import db
-from pydantic import BaseModel
+from pydantic import BaseModel, conlist, root_validator
 from sqlalchemy import DefaultClause, text
 from sqlalchemy.dialects.postgresql import UUID
 
@@ -20,6 +22,12 @@ class Permission(db.Model):
     )
     permission_name: str = db.Column(db.String, unique=True, nullable=False)
 
+    # Not annotated, so left out of the serialized dataclass
+    roles = db.relationship(
+        'Role',
+        secondary=f'{config.pg_schema}.role_permissions',
+        viewonly=True)
+
 
 class PermissionSetRequest(BaseModel):
     permission_uuid: str
@@ -27,3 +35,35 @@ class PermissionSetRequest(BaseModel):
 
 class PermissionCreationRequest(BaseModel):
     permission_name: str
+
+
+# Checks answered by a single batch request
+MAX_PERMISSION_CHECKS = 100
+
+
+class PermissionCheck(BaseModel):
+    user_uuid: UUID_TYPE
+    permission_uuid: UUID_TYPE
+
+
+class PermissionCheckRequest(BaseModel):
+    """Either (user, permission) pairs or one user and its permissions"""
+    checks: conlist(PermissionCheck, max_items=MAX_PERMISSION_CHECKS) = []
+    user_uuid: Optional[UUID_TYPE]
+    permission_uuids: conlist(UUID_TYPE,
+                              max_items=MAX_PERMISSION_CHECKS) = []
+
+    @root_validator(skip_on_failure=True)
+    def check_one_form(cls, values):
+        if bool(values.get('checks')) == bool(values.get('user_uuid')):
+            raise ValueError('Either checks or user_uuid must be given')
+        if values.get('user_uuid') and not values.get('permission_uuids'):
+            raise ValueError('permission_uuids must be given with user_uuid')
+        return values
+
+    def pairs(self) -> list[tuple[UUID_TYPE, UUID_TYPE]]:
+        if self.user_uuid:
+            return [(self.user_uuid, perm_id)
+                    for perm_id in self.permission_uuids]
+        return [(check.user_uuid, check.permission_uuid)
+                for check in self.checks]
@@ -20,6 +20,12 @@ class Role(db.Model):
     )
     role_name: str = db.Column(db.String, unique=True, nullable=False)
 
+    # Not annotated, so left out of the serialized dataclass
+    permissions = db.relationship(
+        'Permission',
+        secondary=f'{config.pg_schema}.role_permissions',
+        viewonly=True)
+
 
 class RoleCreationRequest(BaseModel):
     role_name: str
@@ -28,6 +28,9 @@ class RolePermission(db.Model):
         nullable=False
     )
 
+    role = db.relationship('Role', viewonly=True)
+    permission = db.relationship('Permission', viewonly=True)
+
     def __eq__(self, other):
         return self.role_permission_id == other.role_permission_id
 
@@ -27,3 +27,5 @@ class RoleOwner(db.Model):
         db.ForeignKey(f'{config.pg_schema}.roles.role_id'),
         nullable=False
     )
+
+    role = db.relationship('Role', viewonly=True)
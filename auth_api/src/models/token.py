@@ -1,10 +1,22 @@
+from hashlib import sha256
+
 from core.settings import config
 from db.pg import db
 from sqlalchemy import DefaultClause, FetchedValue, text
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import BYTEA, UUID
 from sqlalchemy.sql import func
 
 
+def digest_token(token_value: str) -> bytes:
+    """Fixed-width key the tokens are looked up by, a JWT is several
+    hundred bytes long."""
+    return sha256(token_value.encode()).digest()
+
+
+def _default_digest(context) -> bytes:
+    return digest_token(context.get_current_parameters()['token_value'])
+
+
 class Token(db.Model):
     query: db.Query  # added for type hinting
     __tablename__ = 'tokens'
@@ -20,6 +32,7 @@ class Token(db.Model):
         db.ForeignKey(f'{config.pg_schema}.users.user_id'),
         nullable=False)
     token_value = db.Column(db.String, nullable=False)
+    token_digest = db.Column(BYTEA, nullable=False, default=_default_digest)
     token_used = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime(timezone=True),
                            server_default=func.now())
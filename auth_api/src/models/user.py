@@ -1,6 +1,9 @@
+from typing import Optional
+from uuid import UUID as UUID_TYPE
+
 from core.settings import config
 from db.pg import db
-from pydantic import BaseModel, EmailStr, constr
+from pydantic import BaseModel, EmailStr, conlist, constr
 from sqlalchemy import DefaultClause, text
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.sql import func
@@ -32,6 +35,31 @@ class User(db.Model):
         return f'<User {self.user_login}>'
 
 
+class UserLogin(db.Model):
+    """Directory of the logins: unique across the partitions of the users
+    and found with a single index probe."""
+    query: db.Query
+    __tablename__ = 'user_logins'
+    __table_args__ = {'schema': config.pg_schema}
+
+    user_login = db.Column(db.String, primary_key=True)
+    user_id = db.Column(UUID(as_uuid=True),
+                        db.ForeignKey(f'{config.pg_schema}.users.user_id'),
+                        nullable=False)
+
+
+class UserEmail(db.Model):
+    """Directory of the emails, see UserLogin."""
+    query: db.Query
+    __tablename__ = 'user_emails'
+    __table_args__ = {'schema': config.pg_schema}
+
+    user_email = db.Column(db.String, primary_key=True)
+    user_id = db.Column(UUID(as_uuid=True),
+                        db.ForeignKey(f'{config.pg_schema}.users.user_id'),
+                        nullable=False)
+
+
 class LoginRequest(BaseModel):
     username: constr(min_length=1, strip_whitespace=True, to_lower=True)
     password: constr(min_length=1, strip_whitespace=True)
@@ -41,9 +69,30 @@ class SignupRequest(LoginRequest):
     email: EmailStr
 
 
-class ModifyRequest(LoginRequest):
-    pass
+class ModifyRequest(BaseModel):
+    """Either field may be left out to keep the current value."""
+    username: Optional[constr(min_length=1, strip_whitespace=True,
+                              to_lower=True)]
+    password: Optional[constr(min_length=1, strip_whitespace=True)]
 
 
 class UserRoleAssignRequest(BaseModel):
     role_uuid: str
+
+
+# Pairs accepted by a single bulk role request
+MAX_BULK_ASSIGNMENTS = 1000
+
+
+class UserRoleAssignment(BaseModel):
+    user_uuid: UUID_TYPE
+    role_uuid: UUID_TYPE
+
+
+class BulkUserRoleRequest(BaseModel):
+    assignments: conlist(UserRoleAssignment, min_items=1,
+                         max_items=MAX_BULK_ASSIGNMENTS)
+
+    def pairs(self) -> list[tuple[UUID_TYPE, UUID_TYPE]]:
+        return [(item.user_uuid, item.role_uuid)
+                for item in self.assignments]
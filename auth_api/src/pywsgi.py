@@ -2,13 +2,27 @@ from gevent import monkey
 
 monkey.patch_all()
 
+import signal  # noqa: E402
+
+import gevent  # noqa: E402
+from core.settings import config  # noqa: E402
+from core.throttle import sync_throttles_periodically  # noqa: E402
 from db.pg import db  # noqa: E402
+from db.token_reaper import reap_tokens_periodically  # noqa: E402
+from db.write_behind import write_behind  # noqa: E402
 from gevent.pywsgi import WSGIServer  # noqa: E402
 from main import create_app  # noqa: E402
 
 if __name__ == '__main__':
     app = create_app()
     db.init_app(app)
+    write_behind.start(app)
+    if config.token_reaper_interval:
+        gevent.spawn(reap_tokens_periodically, app,
+                     config.token_reaper_interval)
+    gevent.spawn(sync_throttles_periodically, config.preauth_sync_interval)
 
     http_server = WSGIServer(('', 8000), app)
+    gevent.signal_handler(signal.SIGTERM, http_server.stop)
     http_server.serve_forever()
+    write_behind.stop()
@@ -5,10 +5,8 @@ from typing import Type, Union
 from core.settings import config
 from core.utils import ServiceException, make_service_exception
 from flask import Request, Response, jsonify, make_response
-from models.role import Role
-from models.roles_owners import RoleOwner
-from models.user import User
 from pydantic import BaseModel, ValidationError
+from services.roles_cache import get_role_id, get_user_role_ids
 
 Rcode = namedtuple('Rcode', 'code message')
 
@@ -39,6 +37,10 @@ class BaseService:
                                  'Access token has expired')
     WRONG_CALLBACK = Rcode('WRONG_CALLBACK',
                            'Code or callback from social service is broken')
+    INVALID_PAGINATION = Rcode('INVALID_PAGINATION',
+                               'The page limit or cursor is invalid')
+    SERVICE_BUSY = Rcode('SERVICE_BUSY',
+                         'Too many requests are being processed, retry later')
 
     def __init__(self):
         pass
@@ -62,24 +64,23 @@ class BaseService:
             user_id: str,
             role_name: str = config.service_admin_role) -> None:
         """Check if user has access to work with roles (superadmin role). """
-        existing_user: User = User.query.get(user_id)
-        if not existing_user:
+        # Not answered from the roles claim, which outlives a revoked role
+        # until the token expires. Both are cached and invalidated on
+        # change, no query is needed in steady state
+        user_role_ids = get_user_role_ids(user_id)
+        if user_role_ids is None:
             error_code = self.USER_NOT_FOUND.code
             message = self.USER_NOT_FOUND.message
 
             raise ServiceException(error_code=error_code, message=message)
 
-        existing_superuser_role: Role = Role.query.filter(
-            Role.role_name == role_name).first()
-        if not existing_superuser_role:
+        superuser_role_id = get_role_id(role_name)
+        if not superuser_role_id:
             error_code = self.ROLE_NOT_FOUND.code
             message = self.ROLE_NOT_FOUND.message
             raise ServiceException(error_code=error_code, message=message)
 
-        existing_role_ownership: RoleOwner = RoleOwner.query.filter(
-            RoleOwner.owner_id == user_id,
-            RoleOwner.role_id == existing_superuser_role.role_id).first()
-        if not existing_role_ownership:
+        if superuser_role_id not in user_role_ids:
             error_code = self.NOT_PERMITTED.code
             message = self.NOT_PERMITTED.message
             raise ServiceException(error_code=error_code, message=message)
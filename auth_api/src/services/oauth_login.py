@@ -5,7 +5,7 @@ from core.oauth import OAuthSignIn, OAuthSignUp
 from core.utils import ServiceException
 from db.pg import db
 from models.social_accounts import SocialAccount, SocialSignupResult
-from models.user import User
+from models.user import User, UserEmail
 from services.base import BaseService
 from services.user import UserService, generate_tokens
 
@@ -37,7 +37,7 @@ class OauthService(BaseService):
             if not user:
                 raise ServiceException(error_code=self.USER_NOT_FOUND.code,
                                        message=self.USER_NOT_FOUND.message)
-            access_token, refresh_token = generate_tokens(user)
+            access_token, refresh_token = generate_tokens(user.user_id)
             UserService.commit_authentication(user=user,
                                               event_type='login',
                                               access_token=access_token,
@@ -49,15 +49,17 @@ class OauthService(BaseService):
             return access_token, refresh_token
 
         # If there is no social account - try to find user by email and create
-        user_with_email: User = User.query.filter(
-            User.user_email == email).first()
+        user_with_email: User = User.query.join(
+            UserEmail, UserEmail.user_id == User.user_id).filter(
+            UserEmail.user_email == email).first()
         if user_with_email:
             new_social_account = SocialAccount(user_id=user_with_email.user_id,
                                                social_id=social_id,
                                                social_provider=social_name)
             db.session.add(new_social_account)
             db.session.commit()
-            access_token, refresh_token = generate_tokens(user_with_email)
+            access_token, refresh_token = generate_tokens(
+                user_with_email.user_id)
             UserService.commit_authentication(user=user_with_email,
                                               event_type='login',
                                               access_token=access_token,
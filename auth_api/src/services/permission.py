@@ -5,6 +5,9 @@ from db.pg import db
 from flask import Request, Response
 from models.permission import Permission, PermissionCreationRequest
 from services.base import BaseService
+from services.perms_cache import invalidate_permission_perms
+from services.rbac import bump_rbac_version
+from services.token_claims import invalidate_permission_claims
 
 
 class PermissionService(BaseService):
@@ -26,6 +29,7 @@ class PermissionService(BaseService):
         new_permission = Permission(permission_name=permission_name)
         db.session.add(new_permission)
         db.session.commit()
+        bump_rbac_version()
         return new_permission
 
     def edit_permission(self, permission_id: str,
@@ -40,6 +44,7 @@ class PermissionService(BaseService):
 
         existing_permission.permission_name = permission_name
         db.session.commit()
+        bump_rbac_version()
         return existing_permission
 
     def delete_permission(self, permission_id: str) -> Permission:
@@ -51,8 +56,11 @@ class PermissionService(BaseService):
             message = self.PERMISSION_NOT_FOUND.message
             raise ServiceException(error_code=error_code, message=message)
 
+        invalidate_permission_claims(permission_id)
+        invalidate_permission_perms(permission_id)
         db.session.delete(existing_permission)
         db.session.commit()
+        bump_rbac_version()
         return existing_permission
 
     def validate_request(
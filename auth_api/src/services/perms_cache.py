@@ -0,0 +1,112 @@
+import time
+from typing import Iterable, NamedTuple, Optional
+
+from core.cache import PERMS_NAMESPACE, invalidation, perms_cache
+from core.generations import bump_generations, fill, generation_key
+from core.settings import config
+from db.pg import db
+from db.redis_client import deferred_redis, redis
+from models.role_permissions import RolePermission
+from models.roles_owners import RoleOwner
+from services.rbac import RBAC_VERSION_KEY
+
+GRANTED = b'1'
+DENIED = b'0'
+# Marks the hash of a user whose permissions have all been resolved
+LOADED_FIELD = '_loaded'
+
+
+def _perms_key(user_id) -> str:
+    return f'perms:{user_id}'
+
+
+class PermDecisions(NamedTuple):
+    # Whether all the permissions of the user are cached
+    cached: bool
+    decisions: dict[str, bool]
+    # The cache generations read along, the decisions resolved from them
+    # are only cached if no change of the user happened meanwhile
+    generation: Optional[bytes] = None
+    version: int = 0
+    # The RBAC version read along, the snapshot resolving the decisions
+    # must be at least as new, and the fills are dropped once it is bumped
+    rbac_version: Optional[bytes] = None
+
+
+def get_perm_decisions(user_id, perm_ids: list[str]) -> PermDecisions:
+    """The cached decisions of the permissions of the user granted or
+    known to be denied."""
+    version = perms_cache.version()
+    decisions = perms_cache.get(str(user_id)) or {}
+    found = {perm_id: decisions[perm_id]
+             for perm_id in perm_ids if perm_id in decisions}
+    missing = [perm_id for perm_id in perm_ids if perm_id not in found]
+    if not missing:
+        return PermDecisions(True, found, version=version)
+
+    pipe = redis.pipeline(transaction=False)
+    pipe.hmget(_perms_key(user_id), LOADED_FIELD, *missing)
+    pipe.get(generation_key(user_id))
+    pipe.get(RBAC_VERSION_KEY)
+    (loaded, *values), generation, rbac_version = pipe.execute()
+    fetched = {perm_id: value == GRANTED
+               for perm_id, value in zip(missing, values) if value is not None}
+    if fetched:
+        _remember(user_id, fetched, version)
+    return PermDecisions(bool(loaded), {**found, **fetched}, generation,
+                         version, rbac_version)
+
+
+def store_user_perms(user_id, perm_ids: Iterable,
+                     lookup: PermDecisions) -> set[str]:
+    """Cache all the permissions granted to the user."""
+    granted = {str(perm_id) for perm_id in perm_ids}
+    with deferred_redis() as pipe:
+        fill(pipe, user_id, lookup.generation, _perms_key(user_id),
+             fields={LOADED_FIELD: GRANTED,
+                     **{perm_id: GRANTED for perm_id in granted}},
+             reset=True, condition=(RBAC_VERSION_KEY, lookup.rbac_version))
+    _remember(user_id, {perm_id: True for perm_id in granted},
+              lookup.version)
+    return granted
+
+
+def remember_denied(user_id, perm_ids: list[str],
+                    lookup: PermDecisions) -> None:
+    """Cache permissions known to exist and not granted to the user."""
+    with deferred_redis() as pipe:
+        fill(pipe, user_id, lookup.generation, _perms_key(user_id),
+             fields={perm_id: DENIED for perm_id in perm_ids},
+             condition=(RBAC_VERSION_KEY, lookup.rbac_version))
+    _remember(user_id, {perm_id: False for perm_id in perm_ids},
+              lookup.version)
+
+
+def _remember(user_id, decisions: dict[str, bool], version: int) -> None:
+    cached = perms_cache.get(str(user_id)) or {}
+    perms_cache.set(str(user_id), {**cached, **decisions},
+                    time.time() + config.cache_time, version)
+
+
+def invalidate_user_perms(user_ids) -> None:
+    user_ids = [str(user_id) for user_id in user_ids]
+    if not user_ids:
+        return
+    with deferred_redis() as pipe:
+        pipe.delete(*[_perms_key(user_id) for user_id in user_ids])
+        bump_generations(pipe, user_ids)
+    for user_id in user_ids:
+        invalidation.publish(PERMS_NAMESPACE, user_id)
+
+
+def invalidate_role_perms(role_id) -> None:
+    owners = db.session.query(RoleOwner.owner_id).filter(
+        RoleOwner.role_id == role_id).all()
+    invalidate_user_perms(owner_id for owner_id, in owners)
+
+
+def invalidate_permission_perms(perm_id) -> None:
+    owners = db.session.query(RoleOwner.owner_id).join(
+        RolePermission, RolePermission.role_id == RoleOwner.role_id).filter(
+        RolePermission.permission_id == perm_id).distinct().all()
+    invalidate_user_perms(owner_id for owner_id, in owners)
@@ -0,0 +1,116 @@
+import threading
+from typing import Iterable, Optional
+
+from core.cache import invalidation
+from db.pg import db
+from db.redis_client import redis
+from models.permission import Permission
+from models.role_permissions import RolePermission
+
+RBAC_NAMESPACE = 'rbac'
+RBAC_VERSION_KEY = 'rbac:version'
+
+
+class RbacSnapshot:
+    """Immutable view of the roles and their permissions.
+
+    Every permission gets a bit, every role the bitset of its permissions,
+    so the permissions of a user are the union of the bitsets of its roles
+    and a check is a single AND. """
+
+    __slots__ = ('version', '_permission_ids', '_permission_bits',
+                 '_role_bits')
+
+    def __init__(self, version: int, permission_ids: Iterable,
+                 role_permissions: Iterable[tuple]):
+        self.version = version
+        self._permission_ids = tuple(str(perm_id) for perm_id in
+                                     permission_ids)
+        self._permission_bits = {perm_id: 1 << bit for bit, perm_id
+                                 in enumerate(self._permission_ids)}
+        role_bits: dict[str, int] = {}
+        for role_id, perm_id in role_permissions:
+            bit = self._permission_bits.get(str(perm_id), 0)
+            role_bits[str(role_id)] = role_bits.get(str(role_id), 0) | bit
+        self._role_bits = role_bits
+
+    @classmethod
+    def load(cls, version: int) -> 'RbacSnapshot':
+        permission_ids = db.session.query(Permission.permission_id).all()
+        role_permissions = db.session.query(
+            RolePermission.role_id, RolePermission.permission_id).all()
+        return cls(version, (perm_id for perm_id, in permission_ids),
+                   role_permissions)
+
+    def permission_exists(self, perm_id) -> bool:
+        return str(perm_id) in self._permission_bits
+
+    def _bits_of(self, role_ids: Iterable) -> int:
+        bits = 0
+        for role_id in role_ids:
+            bits |= self._role_bits.get(str(role_id), 0)
+        return bits
+
+    def has_permission(self, role_ids: Iterable, perm_id) -> bool:
+        bit = self._permission_bits.get(str(perm_id), 0)
+        return bool(self._bits_of(role_ids) & bit)
+
+    def permission_ids_of(self, role_ids: Iterable) -> set[str]:
+        bits = self._bits_of(role_ids)
+        return {perm_id for perm_id, bit in self._permission_bits.items()
+                if bits & bit}
+
+
+class RbacSnapshots:
+    """Current snapshot of the worker, shared by its greenlets.
+
+    Mutations bump a version counter in Redis and notify the workers over
+    the invalidation channel; the snapshot is rebuilt on the next read.
+    Without the channel the version is checked on every read. """
+
+    def __init__(self):
+        self.enabled = False
+        self._snapshot: Optional[RbacSnapshot] = None
+        self._stale = True
+        self._lock = threading.Lock()
+
+    def current(self, version: int = None) -> RbacSnapshot:
+        """The snapshot of the version, read from Redis when not given,
+        e.g. along with other keys. """
+        snapshot = self._snapshot
+        if snapshot and self.enabled and not self._stale and (
+                version is None or snapshot.version == version):
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if version is None:
+                self._stale = False
+                version = int(redis.get(RBAC_VERSION_KEY) or 0)
+                outdated = not snapshot or snapshot.version != version
+            else:
+                # A newer snapshot than the version asked for is kept
+                outdated = not snapshot or snapshot.version < version
+            if outdated:
+                snapshot = RbacSnapshot.load(version)
+                self._snapshot = snapshot
+            return snapshot
+
+    def invalidate(self, key: str = None) -> None:
+        self._stale = True
+
+    def enable(self) -> None:
+        self._stale = True
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+
+rbac_snapshots = invalidation.register(RBAC_NAMESPACE, RbacSnapshots())
+
+
+def bump_rbac_version() -> None:
+    """Called after any change to roles, permissions or their links."""
+    # Not deferred: the snapshot must not be rebuilt from the old version
+    redis.incr(RBAC_VERSION_KEY)
+    invalidation.publish(RBAC_NAMESPACE, '')
@@ -1,5 +1,6 @@
 from typing import Union
 
+from core.cache import ROLE_IDS_NAMESPACE, invalidation
 from core.utils import ServiceException
 from db.pg import db
 from flask import Request, Response
@@ -7,6 +8,11 @@ from models.permission import Permission, PermissionSetRequest
 from models.role import Role, RoleCreationRequest
 from models.role_permissions import RolePermission
 from services.base import BaseService
+from services.perms_cache import invalidate_role_perms
+from services.rbac import bump_rbac_version
+from services.roles_cache import invalidate_role
+from services.token_claims import invalidate_role_claims
+from sqlalchemy.orm import selectinload
 
 
 class RoleService(BaseService):
@@ -30,6 +36,9 @@ class RoleService(BaseService):
         new_role = Role(role_name=role_name)
         db.session.add(new_role)
         db.session.commit()
+        bump_rbac_version()
+        # The name may still be memoized with the ID of a deleted role
+        invalidation.publish(ROLE_IDS_NAMESPACE, role_name)
         return new_role
 
     def edit_role(self, role_id: str, role_name: str) -> Role:
@@ -41,8 +50,13 @@ class RoleService(BaseService):
             message = self.ROLE_NOT_FOUND.message
             raise ServiceException(error_code=error_code, message=message)
 
+        old_role_name = existing_role.role_name
         existing_role.role_name = role_name
         db.session.commit()
+        bump_rbac_version()
+        invalidate_role_claims(role_id)
+        invalidation.publish(ROLE_IDS_NAMESPACE, old_role_name)
+        invalidation.publish(ROLE_IDS_NAMESPACE, role_name)
         return existing_role
 
     def delete_role(self, role_id: str) -> Role:
@@ -54,23 +68,25 @@ class RoleService(BaseService):
             message = self.ROLE_NOT_FOUND.message
             raise ServiceException(error_code=error_code, message=message)
 
+        invalidate_role_claims(role_id)
+        invalidate_role_perms(role_id)
+        invalidate_role(role_id, existing_role.role_name)
         db.session.delete(existing_role)
         db.session.commit()
+        bump_rbac_version()
         return existing_role
 
     def get_role_permissions(self, role_id: str) -> list[Permission]:
         """Show list of Permissions assigned to role by Role UUID. """
-        existing_role: Role = Role.query.filter(
+        # The permissions are loaded by a second query, whatever their number
+        existing_role: Role = Role.query.options(
+            selectinload(Role.permissions)).filter(
             Role.role_id == role_id).first()
         if not existing_role:
             error_code = self.ROLE_NOT_FOUND.code
             message = self.ROLE_NOT_FOUND.message
             raise ServiceException(error_code=error_code, message=message)
-        role_perms = RolePermission.query.filter(
-            RolePermission.role_id == role_id).all()
-        perm_ids = [rp.permission_id for rp in role_perms]
-        perms = [Permission.query.get(perm_id) for perm_id in perm_ids]
-        return perms
+        return existing_role.permissions
 
     def set_role_permissions(self, role_id: str,
                              perm_id: str) -> Permission:
@@ -85,6 +101,9 @@ class RoleService(BaseService):
         rp = RolePermission(role_id=role_id, permission_id=perm_id)
         db.session.add(rp)
         db.session.commit()
+        bump_rbac_version()
+        invalidate_role_claims(role_id)
+        invalidate_role_perms(role_id)
         perm: Permission = Permission.query.get(rp.permission_id)
         return perm
 
@@ -101,6 +120,9 @@ class RoleService(BaseService):
         perm: Permission = Permission.query.get(perm_id)
         db.session.delete(existing_role_perm)
         db.session.commit()
+        bump_rbac_version()
+        invalidate_role_claims(role_id)
+        invalidate_role_perms(role_id)
         return perm
 
     def validate_role_request(
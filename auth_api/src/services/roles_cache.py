@@ -0,0 +1,84 @@
+import json
+import time
+from typing import Optional
+
+from core.cache import (ROLE_IDS_NAMESPACE, USER_ROLES_NAMESPACE, invalidation,
+                        role_id_cache, user_roles_cache)
+from core.generations import bump_generations, fill, generation_key
+from core.settings import config
+from db.pg import db
+from db.redis_client import deferred_redis, redis
+from models.role import Role
+from models.roles_owners import RoleOwner
+from models.user import User
+
+
+def _user_roles_key(user_id) -> str:
+    return f'user_roles:{user_id}'
+
+
+def get_role_id(role_name: str) -> Optional[str]:
+    """ID of the role with the name, memoized by every worker until a
+    role with the name is created, renamed or deleted. Roles changed
+    behind the service, straight in Postgres, must publish the
+    invalidation of their name or are seen up to CACHE_TIME later."""
+    role_id = role_id_cache.get(role_name)
+    if role_id is not None:
+        return role_id
+
+    version = role_id_cache.version()
+    role_id = db.session.query(Role.role_id).filter(
+        Role.role_name == role_name).scalar()
+    if role_id is None:
+        role_id_cache.delete(role_name)
+        return None
+    role_id_cache.set(role_name, str(role_id),
+                      time.time() + config.cache_time, version)
+    return str(role_id)
+
+
+def get_user_role_ids(user_id) -> Optional[frozenset[str]]:
+    """IDs of the roles owned by the user, None for an unknown user."""
+    role_ids = user_roles_cache.get(str(user_id))
+    if role_ids is not None:
+        return role_ids
+
+    version = user_roles_cache.version()
+    cached, generation = redis.mget(_user_roles_key(user_id),
+                                    generation_key(user_id))
+    if cached is not None:
+        role_ids = frozenset(json.loads(cached))
+    else:
+        # The user and its roles in a single query
+        rows = db.session.query(User.user_id, RoleOwner.role_id).outerjoin(
+            RoleOwner, RoleOwner.owner_id == User.user_id).filter(
+            User.user_id == user_id).all()
+        if not rows:
+            return None
+        role_ids = frozenset(str(role_id) for _, role_id in rows if role_id)
+        with deferred_redis() as pipe:
+            fill(pipe, user_id, generation, _user_roles_key(user_id),
+                 json.dumps(list(role_ids)))
+
+    user_roles_cache.set(str(user_id), role_ids,
+                         time.time() + config.cache_time, version)
+    return role_ids
+
+
+def invalidate_user_roles(user_ids) -> None:
+    user_ids = [str(user_id) for user_id in user_ids]
+    if not user_ids:
+        return
+    with deferred_redis() as pipe:
+        pipe.delete(*[_user_roles_key(user_id) for user_id in user_ids])
+        bump_generations(pipe, user_ids)
+    for user_id in user_ids:
+        invalidation.publish(USER_ROLES_NAMESPACE, user_id)
+
+
+def invalidate_role(role_id, role_name: str) -> None:
+    """Forget the role name and who owns the role, before it is deleted."""
+    invalidation.publish(ROLE_IDS_NAMESPACE, role_name)
+    owners = db.session.query(RoleOwner.owner_id).filter(
+        RoleOwner.role_id == role_id).all()
+    invalidate_user_roles(owner_id for owner_id, in owners)
@@ -0,0 +1,90 @@
+import base64
+import json
+from uuid import UUID
+
+from core.generations import bump_generations, fill, generation_key
+from core.jwks import uses_asymmetric_signing
+from core.settings import config
+from db.pg import db
+from db.redis_client import deferred_redis, redis
+from models.role import Role
+from models.role_permissions import RolePermission
+from models.roles_owners import RoleOwner
+
+
+def embeds_claims() -> bool:
+    """Access tokens carry the roles (and optionally permissions)
+    of the user, so other checks can be answered from the token."""
+    return config.jwt_embed_permissions or uses_asymmetric_signing()
+
+
+def encode_ids(ids) -> str:
+    """Compact form of a set of UUIDs: base64 of their sorted bytes."""
+    raw = b''.join(sorted(UUID(str(id_)).bytes for id_ in ids))
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_ids(encoded: str) -> set[str]:
+    raw = base64.urlsafe_b64decode(encoded)
+    return {str(UUID(bytes=raw[i:i + 16])) for i in range(0, len(raw), 16)}
+
+
+def _claims_key(user_id) -> str:
+    return f'claims:{user_id}'
+
+
+def get_user_claims(user_id) -> dict:
+    """Role names and permission IDs of the user to put in access tokens.
+    The blob is precomputed in Redis and dropped on role changes. """
+    cached, generation = redis.mget(_claims_key(user_id),
+                                    generation_key(user_id))
+    if cached:
+        return json.loads(cached)
+
+    roles = db.session.query(Role.role_name).join(
+        RoleOwner, RoleOwner.role_id == Role.role_id).filter(
+        RoleOwner.owner_id == user_id).all()
+    claims = {'roles': [role_name for role_name, in roles]}
+    if config.jwt_embed_permissions:
+        perms = db.session.query(RolePermission.permission_id).join(
+            RoleOwner, RoleOwner.role_id == RolePermission.role_id).filter(
+            RoleOwner.owner_id == user_id).distinct().all()
+        claims['perms'] = encode_ids(perm_id for perm_id, in perms)
+
+    with deferred_redis() as pipe:
+        fill(pipe, user_id, generation, _claims_key(user_id),
+             json.dumps(claims))
+    return claims
+
+
+def invalidate_user_claims(user_ids) -> None:
+    """Tokens issued from now on get the current roles and permissions,
+    the ones already issued keep theirs until they expire. """
+    if not embeds_claims():
+        return
+    user_ids = [str(user_id) for user_id in user_ids]
+    if user_ids:
+        with deferred_redis() as pipe:
+            pipe.delete(*[_claims_key(user_id) for user_id in user_ids])
+            bump_generations(pipe, user_ids)
+
+
+def invalidate_role_claims(role_id) -> None:
+    if not embeds_claims():
+        return
+    owners = db.session.query(RoleOwner.owner_id).filter(
+        RoleOwner.role_id == role_id).all()
+    invalidate_user_claims(owner_id for owner_id, in owners)
+
+
+def invalidate_permission_claims(perm_id) -> None:
+    if not embeds_claims():
+        return
+    owners = db.session.query(RoleOwner.owner_id).join(
+        RolePermission, RolePermission.role_id == RoleOwner.role_id).filter(
+        RolePermission.permission_id == perm_id).distinct().all()
+    invalidate_user_claims(owner_id for owner_id, in owners)
+
+
+def has_permission(claims: dict, perm_id) -> bool:
+    return str(perm_id) in decode_ids(claims['perms'])
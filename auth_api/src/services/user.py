@@ -1,64 +1,171 @@
-from typing import Union
-
+import base64
+import heapq
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Iterable, Iterator, Optional, Union
+from uuid import UUID, uuid4
+
+from core.hashing import HashingPoolBusy, password_hasher
+from core.refresh_tokens import (REUSED, ROTATED, end_refresh_family,
+                                 rotate_refresh_family, start_refresh_family)
+from core.revocation import (end_session, is_access_token_active,
+                             register_access_token, revoke_access_token)
 from core.settings import config
 from core.utils import ServiceException, trace
 from db.pg import db
-from db.redis_client import redis
+from db.write_behind import write_behind
 from flask import Request, Response
-from flask_jwt_extended import create_access_token, create_refresh_token
+from flask_jwt_extended import (create_access_token, create_refresh_token,
+                                decode_token)
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
 from models.auth_event import AuthEvent
-from models.token import Token
-from models.user import LoginRequest, ModifyRequest, SignupRequest, User
+from models.token import Token, digest_token
+from models.user import (LoginRequest, ModifyRequest, SignupRequest, User,
+                         UserEmail, UserLogin)
 from services.base import BaseService
-from werkzeug.security import check_password_hash, generate_password_hash
-
-
-def generate_tokens(user: User):
-    """ Create new access and refresh tokens for the user"""
-    user_data = {'user_id': user.user_id, }
+from services.token_claims import embeds_claims, get_user_claims
+from services.user_filter import email_filter, login_filter, remember_users
+from sqlalchemy import bindparam, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+INSERT_AUTH_EVENT = AuthEvent.__table__.insert()
+# Return the user id only when the login wasn't taken yet
+CLAIM_LOGIN = insert(UserLogin).on_conflict_do_nothing().returning(
+    UserLogin.user_id)
+# Claim the login and email, insert the user only if both were free and
+# its refresh token, if any, along with it: a signup is a single statement
+SIGNUP = text(f"""
+WITH login AS (
+    INSERT INTO {config.pg_schema}.user_logins (user_login, user_id)
+    VALUES (:user_login, :user_id)
+    ON CONFLICT DO NOTHING RETURNING user_id
+), email AS (
+    INSERT INTO {config.pg_schema}.user_emails (user_email, user_id)
+    VALUES (:user_email, :user_id)
+    ON CONFLICT DO NOTHING RETURNING user_id
+), new_user AS (
+    INSERT INTO {config.pg_schema}.users
+        (user_id, user_login, user_password, user_email)
+    SELECT user_id, :user_login, :user_password, :user_email
+    FROM login JOIN email USING (user_id)
+    RETURNING user_id
+), token AS (
+    INSERT INTO {config.pg_schema}.tokens
+        (token_owner_id, token_value, token_digest)
+    SELECT user_id, :token_value, :token_digest
+    FROM new_user WHERE :token_value IS NOT NULL
+)
+SELECT EXISTS (SELECT FROM login), EXISTS (SELECT FROM email)
+""")
+INSERT_TOKEN = Token.__table__.insert()
+DELETE_TOKEN = Token.__table__.delete().where(
+    Token.token_digest == bindparam('old_token_digest'))
+
+HISTORY_PAGE_SIZE = 100
+HISTORY_MAX_PAGE_SIZE = 1000
+# Rows fetched at once from the server-side cursor of a streamed history
+HISTORY_STREAM_BATCH = 1000
+
+
+def generate_tokens(user_id, family: str = None):
+    """ Create new access and refresh tokens for the user,
+    the refresh token starts a new family unless one is given"""
+    user_data = {'user_id': user_id, }
+    access_claims = dict(user_data)
+    if embeds_claims():
+        # Lets the user be authorized from the token alone
+        access_claims.update(get_user_claims(user_id))
     access_token = create_access_token(
-        identity=user.user_id, additional_claims=user_data
+        identity=user_id, additional_claims=access_claims
     )
     refresh_token = create_refresh_token(
-        identity=user.user_id, additional_claims=user_data
+        identity=user_id,
+        additional_claims={**user_data, 'fam': family or uuid4().hex}
     )
     return access_token, refresh_token
 
 
 def authenticate(access_token) -> None:
     """Check that access token is fresh"""
-    if not redis.get(access_token) == b'':
+    if not is_access_token_active(access_token, decode_token(access_token)):
         raise ServiceException(error_code='ACCESS_TOKEN_EXPIRED',
                                message='Access token has expired')
 
 
+def history_item(event: AuthEvent) -> dict:
+    return {'uuid': event.auth_event_id,
+            'time': event.auth_event_time,
+            'fingerprint': event.auth_event_fingerprint}
+
+
+def history_key(event: AuthEvent) -> tuple[datetime, str]:
+    """ Position of the event in the history, ordered as in Postgres """
+    return event.auth_event_time, str(event.auth_event_id)
+
+
+def encode_history_cursor(event: AuthEvent) -> str:
+    """ Opaque position of the event in the history """
+    position = f'{event.auth_event_time.isoformat()}|{event.auth_event_id}'
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_history_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        position = base64.urlsafe_b64decode(cursor.encode()).decode()
+    except (ValueError, UnicodeError):
+        raise ValueError('Malformed history cursor')
+    event_time, _, event_id = position.partition('|')
+    return datetime.fromisoformat(event_time), str(UUID(event_id))
+
+
 class UserService(BaseService):
     @trace
     def create_user(self,
                     username: str,
                     password: str,
-                    email: str):
-        existing_user: User = User.query.filter(
-            (User.user_login == username) | (User.user_email == email)
-        ).first()
-
-        if existing_user:
-            if existing_user.user_login == username:
-                error_code = self.LOGIN_EXISTS.code
-                message = self.LOGIN_EXISTS.message
-            else:
-                error_code = self.EMAIL_EXISTS.code
-                message = self.EMAIL_EXISTS.message
-            raise ServiceException(error_code=error_code, message=message)
-
-        password_hash = generate_password_hash(password)
-
-        user = User(user_login=username,
-                    user_password=password_hash,
-                    user_email=email)
-        db.session.add(user)
+                    email: str,
+                    user_id: UUID = None,
+                    refresh_token: str = None) -> UUID:
+        """ Insert the user, and its refresh token if given, in one
+        statement and transaction. Taken logins and emails are detected
+        by the directories' constraints, they are only looked up first,
+        before hashing the password, if the filters can't rule them out """
+        user_id = user_id or uuid4()
+        if login_filter.might_contain(username) or \
+                email_filter.might_contain(email):
+            self._check_available(username, email)
+        password_hash = self._hash_password(password)
+
+        login_claimed, email_claimed = db.session.execute(SIGNUP, {
+            'user_id': str(user_id),
+            'user_login': username,
+            'user_password': password_hash,
+            'user_email': email,
+            'token_value': refresh_token,
+            'token_digest': refresh_token and digest_token(refresh_token)
+        }).one()
+        if not (login_claimed and email_claimed):
+            db.session.rollback()
+            rcode = self.EMAIL_EXISTS if login_claimed else self.LOGIN_EXISTS
+            raise ServiceException(error_code=rcode.code,
+                                   message=rcode.message)
+
+        remember_users([username], [email])
         db.session.commit()
-        return user
+        return user_id
+
+    def _check_available(self, username: str, email: str) -> None:
+        """Look the login and email up in a single query."""
+        login_taken, email_taken = db.session.query(
+            UserLogin.query.filter(UserLogin.user_login == username).exists(),
+            UserEmail.query.filter(UserEmail.user_email == email).exists()
+        ).one()
+        if login_taken or email_taken:
+            db.session.rollback()
+            rcode = self.LOGIN_EXISTS if login_taken else self.EMAIL_EXISTS
+            raise ServiceException(error_code=rcode.code,
+                                   message=rcode.message)
 
     @trace
     def register_user(self,
@@ -69,33 +176,37 @@ class UserService(BaseService):
         """ Check that a new user with these credentials can be added,
         if so, create the user and return its access and refresh tokens,
         otherwise, throw an exception telling what happened """
-        user = self.create_user(username, password, email)
-        access_token, refresh_token = generate_tokens(user)
-        self.commit_authentication(user,
-                                   'signup',
-                                   access_token,
-                                   refresh_token,
-                                   user_info)
-
+        # The id is known upfront so the tokens are issued before the
+        # user and its refresh token are inserted together
+        user_id = uuid4()
+        access_token, refresh_token = generate_tokens(user_id)
+        self.create_user(username, password, email, user_id, refresh_token)
+
+        start_refresh_family(decode_token(refresh_token))
+        register_access_token(access_token)
         return access_token, refresh_token
 
     @trace
     def login(self, username: str, password: str, user_info: dict) \
             -> tuple[str, str]:
+        if not login_filter.might_contain(username):
+            raise ServiceException(error_code=self.USER_NOT_FOUND.code,
+                                   message=self.USER_NOT_FOUND.message)
 
-        user: User = User.query.filter(
-            User.user_login == username
+        user: User = User.query.join(
+            UserLogin, UserLogin.user_id == User.user_id).filter(
+            UserLogin.user_login == username
         ).first()
 
         if not user:
             raise ServiceException(error_code=self.USER_NOT_FOUND.code,
                                    message=self.USER_NOT_FOUND.message)
 
-        if not check_password_hash(user.user_password, password):
+        if not self._check_password(user.user_password, password):
             raise ServiceException(error_code=self.WRONG_PASSWORD.code,
                                    message=self.WRONG_PASSWORD.message)
 
-        access_token, refresh_token = generate_tokens(user)
+        access_token, refresh_token = generate_tokens(user.user_id)
         self.commit_authentication(user=user,
                                    event_type='login',
                                    access_token=access_token,
@@ -106,6 +217,32 @@ class UserService(BaseService):
 
     @trace
     def refresh(self, user_id: str, refresh_token: str) -> tuple[str, str]:
+        claims = decode_token(refresh_token)
+        access_token, new_refresh_token = generate_tokens(
+            user_id, claims.get('fam'))
+
+        # Common case: the token family is in Redis, rotation, reuse
+        # detection and the registration of the access token take one
+        # round trip and Postgres is only updated asynchronously
+        if 'fam' in claims:
+            rotation = rotate_refresh_family(
+                claims, decode_token(new_refresh_token), access_token)
+            if rotation == REUSED:
+                # Either the user or a thief used a stolen token,
+                # the whole family has been revoked
+                raise ServiceException(
+                    error_code=self.INVALID_REFRESH_TOKEN.code,
+                    message=self.INVALID_REFRESH_TOKEN.message)
+            if rotation == ROTATED:
+                write_behind.execute(
+                    DELETE_TOKEN,
+                    {'old_token_digest': digest_token(refresh_token)})
+                write_behind.execute(INSERT_TOKEN,
+                                     {'token_owner_id': user_id,
+                                      'token_value': new_refresh_token})
+                db.session.commit()
+                return access_token, new_refresh_token
+
         user: User = User.query.get(user_id)
 
         if not user:
@@ -117,21 +254,19 @@ class UserService(BaseService):
         # The Refresh request will disqualify any previously emitted (stolen)
         # refresh cookies
         current_refresh_token = Token.query.filter(
-            Token.token_value == refresh_token).first()
+            Token.token_digest == digest_token(refresh_token)).first()
         if not current_refresh_token:
             raise ServiceException(error_code=self.INVALID_REFRESH_TOKEN.code,
                                    message=self.INVALID_REFRESH_TOKEN.message)
 
-        access_token, refresh_token = generate_tokens(user)
         db.session.delete(current_refresh_token)
-        db.session.commit()
 
         self.commit_authentication(user=user,
                                    event_type='refresh',
                                    access_token=access_token,
-                                   refresh_token=refresh_token)
+                                   refresh_token=new_refresh_token)
 
-        return access_token, refresh_token
+        return access_token, new_refresh_token
 
     @trace
     def logout(self, user_id: str, access_token: str, refresh_token: str):
@@ -143,59 +278,153 @@ class UserService(BaseService):
             raise ServiceException(error_code=self.USER_NOT_FOUND.code,
                                    message=self.USER_NOT_FOUND.message)
 
-        current_refresh_token = Token.query.filter(
-            Token.token_value == refresh_token).first()
-        if not current_refresh_token:
+        try:
+            claims = decode_token(refresh_token)
+        except (JWTExtendedException, PyJWTError):
             raise ServiceException(error_code=self.INVALID_REFRESH_TOKEN.code,
                                    message=self.INVALID_REFRESH_TOKEN.message)
-        # Delete the access token
-        db.session.delete(current_refresh_token)
-        db.session.commit()
 
+        # Common case: the token family is in Redis, the check of the
+        # refresh token and the revocation of both tokens take one round
+        # trip
+        ended = end_session(access_token, claims)
+        if ended is None:
+            # The family is unknown to Redis, check Postgres
+            current_refresh_token = Token.query.filter(
+                Token.token_digest == digest_token(refresh_token)).first()
+            if current_refresh_token:
+                end_refresh_family(claims)
+                revoke_access_token(access_token)
+            ended = current_refresh_token is not None
+        if not ended:
+            raise ServiceException(error_code=self.INVALID_REFRESH_TOKEN.code,
+                                   message=self.INVALID_REFRESH_TOKEN.message)
         # Delete the refresh token
-        redis.delete(access_token)
+        write_behind.execute(DELETE_TOKEN,
+                             {'old_token_digest': digest_token(refresh_token)})
+        db.session.commit()
 
         return access_token, refresh_token
 
     @trace
-    def modify(self, user_id, new_username: str, new_password: str):
-        """change user's username and password"""
+    def modify(self, user_id, new_username: Optional[str],
+               new_password: Optional[str]):
+        """change user's username and/or password"""
         user: User = User.query.get(user_id)
 
         if not user:
             raise ServiceException(error_code=self.USER_NOT_FOUND.code,
                                    message=self.USER_NOT_FOUND.message)
 
-        if not new_username == user.user_login:
+        if new_username and not new_username == user.user_login:
             # make sure there is no other user with the target username
-            existing_user = User.query.filter(
-                (User.user_login == new_username)
-            ).first()
-
-            if existing_user:
+            if not self._claim(CLAIM_LOGIN, user_login=new_username,
+                               user_id=user.user_id):
                 raise ServiceException(error_code=self.LOGIN_EXISTS.code,
                                        message=self.LOGIN_EXISTS.message)
+            UserLogin.query.filter(
+                UserLogin.user_login == user.user_login).delete()
 
             user.user_login = new_username
 
-        if not new_password == user.user_password:
-            user.user_password = new_password
+        # Hashed whenever given: cheaper than verifying it is a new one
+        # first, which costs the same as a hash
+        if new_password:
+            user.user_password = self._hash_password(new_password)
 
         if db.session.is_modified(user):
+            remember_users([user.user_login])
             db.session.commit()
 
     @trace
-    def get_auth_history(self, user_id):
-        history: list[AuthEvent] = AuthEvent.query.filter(
-            (AuthEvent.auth_event_owner_id == user_id)
-        ).all()
-
-        result = []
-        for event in history:
-            result.append({'uuid': event.auth_event_id,
-                           'time': event.auth_event_time,
-                           'fingerprint': event.auth_event_fingerprint})
-        return result
+    def get_auth_history(self, user_id, limit: int = HISTORY_PAGE_SIZE,
+                         after: str = None) -> tuple[list[dict],
+                                                     Optional[str]]:
+        """ A page of the authentication events, newest first, with the
+        cursor of the next page if there may be one """
+        if not 0 < limit <= HISTORY_MAX_PAGE_SIZE:
+            raise ServiceException(error_code=self.INVALID_PAGINATION.code,
+                                   message=self.INVALID_PAGINATION.message)
+        position = self._history_position(after)
+        events = self._history_query(user_id, position).limit(limit).all()
+        history = list(islice(
+            self._with_pending(events, user_id, position), limit))
+
+        next_cursor = None
+        if len(history) == limit:
+            next_cursor = encode_history_cursor(history[-1])
+        return [history_item(event) for event in history], next_cursor
+
+    def stream_auth_history(self, user_id,
+                            after: str = None) -> Iterator[dict]:
+        """ All the authentication events, newest first, read from
+        a server-side cursor as they are consumed """
+        position = self._history_position(after)
+        query = self._history_query(user_id, position).execution_options(
+            stream_results=True).yield_per(HISTORY_STREAM_BATCH)
+        return (history_item(event) for event
+                in self._with_pending(query, user_id, position))
+
+    def _history_position(self, after: Optional[str]) \
+            -> Optional[tuple[datetime, str]]:
+        if not after:
+            return None
+        try:
+            return decode_history_cursor(after)
+        except ValueError:
+            raise ServiceException(error_code=self.INVALID_PAGINATION.code,
+                                   message=self.INVALID_PAGINATION.message)
+
+    def _history_query(self, user_id,
+                       position: Optional[tuple[datetime, str]]) -> db.Query:
+        query = AuthEvent.query.filter(
+            (AuthEvent.auth_event_owner_id == user_id))
+        if position:
+            query = query.filter(
+                tuple_(AuthEvent.auth_event_time, AuthEvent.auth_event_id)
+                < tuple_(*position))
+        return query.order_by(AuthEvent.auth_event_time.desc(),
+                              AuthEvent.auth_event_id.desc())
+
+    def _with_pending(self, events: Iterable[AuthEvent], user_id,
+                      position: Optional[tuple[datetime, str]]) \
+            -> Iterator[AuthEvent]:
+        """ Merge the events of the user still waiting in the write-behind
+        queue into the ones read from Postgres, to read own writes """
+        pending = [AuthEvent(**params) for params in write_behind.pending(
+            INSERT_AUTH_EVENT,
+            lambda params: str(params['auth_event_owner_id']) == str(user_id))]
+        pending = sorted((event for event in pending if not position
+                          or history_key(event) < position),
+                         key=history_key, reverse=True)
+        queued = {str(event.auth_event_id) for event in pending}
+        # An event may be committed while still listed as pending
+        return heapq.merge(pending, (event for event in events
+                                     if str(event.auth_event_id)
+                                     not in queued),
+                           key=history_key, reverse=True)
+
+    def _claim(self, statement, **params) -> bool:
+        """Insert the directory entry, rolling the transaction back
+        if it is already taken."""
+        if db.session.execute(statement, params).first():
+            return True
+        db.session.rollback()
+        return False
+
+    def _hash_password(self, password: str) -> str:
+        try:
+            return password_hasher.generate(password)
+        except HashingPoolBusy:
+            raise ServiceException(error_code=self.SERVICE_BUSY.code,
+                                   message=self.SERVICE_BUSY.message)
+
+    def _check_password(self, password_hash: str, password: str) -> bool:
+        try:
+            return password_hasher.check(password_hash, password)
+        except HashingPoolBusy:
+            raise ServiceException(error_code=self.SERVICE_BUSY.code,
+                                   message=self.SERVICE_BUSY.message)
 
     # TODO: see if this can be reused on login or disassemble it
     @staticmethod
@@ -208,17 +437,22 @@ class UserService(BaseService):
         """ Finalize successful authentication saving the details."""
         token = Token(token_owner_id=user.user_id, token_value=refresh_token)
         db.session.add(token)
+        start_refresh_family(decode_token(refresh_token))
 
         if event_type == 'login':
-            auth_event = AuthEvent(auth_event_owner_id=user.user_id,
-                                   auth_event_type=event_type,
-                                   auth_event_fingerprint=str(user_info))
-            db.session.add(auth_event)
+            # The audit row is written in bulk off the request path
+            # when the write-behind worker is running
+            auth_event = {
+                'auth_event_id': str(uuid4()),
+                'auth_event_owner_id': user.user_id,
+                'auth_event_type': event_type,
+                'auth_event_time': datetime.now(timezone.utc),
+                'auth_event_fingerprint': str(user_info)
+            }
+            write_behind.execute(INSERT_AUTH_EVENT, auth_event)
 
         db.session.commit()
-        redis.set(name=access_token,
-                  value='',
-                  ex=config.access_token_expiration)
+        register_access_token(access_token)
 
     @trace
     def validate_signup(
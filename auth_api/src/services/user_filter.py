@@ -0,0 +1,36 @@
+from typing import Iterable, Iterator
+
+from core.bloom import RedisBloomFilter
+from core.settings import config
+from db.pg import db
+from models.user import UserEmail, UserLogin
+
+# Negative caches of the logins and emails: a user is only looked up
+# in Postgres when the filter can't rule it out
+login_filter = RedisBloomFilter('bloom:logins', config.user_filter_capacity,
+                                config.user_filter_error_rate)
+email_filter = RedisBloomFilter('bloom:emails', config.user_filter_capacity,
+                                config.user_filter_error_rate)
+
+REBUILD_BATCH = 10000
+
+
+def remember_users(logins: Iterable[str],
+                   emails: Iterable[str] = ()) -> None:
+    """Called before the users are committed, so no committed user is
+    ever missing from the filters. Raises RedisError if they could be."""
+    login_filter.add(*logins)
+    email_filter.add(*emails)
+
+
+def rebuild_user_filters() -> tuple[int, int]:
+    """Rebuild both filters from the login and email directories,
+    read in batches from a server-side cursor."""
+    def column(field) -> Iterator[str]:
+        query = db.session.query(field).execution_options(
+            stream_results=True).yield_per(REBUILD_BATCH)
+        return (value for value, in query)
+
+    logins = login_filter.rebuild(column(UserLogin.user_login), REBUILD_BATCH)
+    emails = email_filter.rebuild(column(UserEmail.user_email), REBUILD_BATCH)
+    return logins, emails
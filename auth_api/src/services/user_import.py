@@ -0,0 +1,134 @@
+import csv
+import io
+import json
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+from typing import IO, Iterable, Iterator, Optional
+
+from core.settings import config
+from db.pg import db
+from models.user import UserEmail, UserLogin
+from services.user_filter import remember_users
+from werkzeug.security import generate_password_hash
+
+IMPORT_FORMATS = ('csv', 'ndjson')
+
+# Columns of the tables loaded by COPY, the others get their defaults
+COPY_COLUMNS = {
+    'users': ('user_id', 'user_login', 'user_password', 'user_email'),
+    'user_logins': ('user_login', 'user_id'),
+    'user_emails': ('user_email', 'user_id'),
+}
+
+
+@dataclass
+class ImportStats:
+    imported: int = 0
+    duplicates: int = 0
+    invalid: int = 0
+
+
+def read_users(source: IO, import_format: str) -> Iterator[dict]:
+    """Users of a CSV file with a header or of NDJSON lines, with
+    username, email and either password or password_hash fields."""
+    if import_format == 'csv':
+        yield from csv.DictReader(source)
+        return
+    for line in source:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield {}
+
+
+def normalize_user(row: dict) -> Optional[dict]:
+    """Login and email as signup stores them, None for invalid rows."""
+    if not isinstance(row, dict):
+        return None
+    username = (row.get('username') or '').strip().lower()
+    email = (row.get('email') or '').strip()
+    password = row.get('password') or ''
+    password_hash = row.get('password_hash') or ''
+    if not username or '@' not in email or not (password or password_hash):
+        return None
+    return {'user_id': str(uuid.uuid4()),
+            'user_login': username, 'user_email': email,
+            'password': password, 'user_password': password_hash}
+
+
+def _dedupe(users: list[dict], stats: ImportStats) -> list[dict]:
+    """Drop the users whose login or email is taken, by an earlier row
+    of the batch or by a user in the database (a query per directory)."""
+    logins = {user['user_login'] for user in users}
+    emails = {user['user_email'] for user in users}
+    taken_logins = {login for login, in db.session.query(
+        UserLogin.user_login).filter(UserLogin.user_login.in_(logins))}
+    taken_emails = {email for email, in db.session.query(
+        UserEmail.user_email).filter(UserEmail.user_email.in_(emails))}
+
+    unique = []
+    for user in users:
+        if user['user_login'] in taken_logins or (
+                user['user_email'] in taken_emails):
+            stats.duplicates += 1
+            continue
+        taken_logins.add(user['user_login'])
+        taken_emails.add(user['user_email'])
+        unique.append(user)
+    return unique
+
+
+def _copy_users(users: list[dict]) -> None:
+    """Copy the users and their login and email directory entries."""
+    cursor = db.session.connection().connection.cursor()
+    for table, columns in COPY_COLUMNS.items():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for user in users:
+            writer.writerow([user[column] for column in columns])
+        buffer.seek(0)
+        cursor.copy_expert(
+            f'COPY {config.pg_schema}.{table} ({", ".join(columns)}) '
+            f'FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def import_users(rows: Iterable[dict], batch_size: int,
+                 workers: Optional[int] = None) -> ImportStats:
+    """Load users in batches, each deduplicated, hashed in parallel
+    and copied in its own transaction, so an interrupted import can
+    simply be run again."""
+    stats = ImportStats()
+    rows = iter(rows)
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as pool:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            users = []
+            for row in batch:
+                user = normalize_user(row)
+                if user is None:
+                    stats.invalid += 1
+                else:
+                    users.append(user)
+            users = _dedupe(users, stats) if users else []
+
+            to_hash = [user for user in users if not user['user_password']]
+            hashes = pool.map(generate_password_hash,
+                              [user['password'] for user in to_hash],
+                              chunksize=max(len(to_hash) // (workers * 4), 1))
+            for user, password_hash in zip(to_hash, hashes):
+                user['user_password'] = password_hash
+
+            if users:
+                _copy_users(users)
+            remember_users([user['user_login'] for user in users],
+                           [user['user_email'] for user in users])
+            db.session.commit()
+            stats.imported += len(users)
+    return stats
@@ -1,11 +1,19 @@
+from collections import defaultdict
+from typing import Union
+
 from core.settings import config
-from core.utils import ServiceException
-from db.redis_client import redis
-from models.permission import Permission
+from core.utils import ServiceException, get_verified_claims
+from flask import Request, Response
+from models.permission import Permission, PermissionCheckRequest
 from models.role_permissions import RolePermission
 from models.roles_owners import RoleOwner
 from models.user import User
 from services.base import BaseService
+from services.perms_cache import (PermDecisions, get_perm_decisions,
+                                  remember_denied, store_user_perms)
+from services.rbac import rbac_snapshots
+from services.roles_cache import get_user_role_ids
+from services.token_claims import has_permission
 
 
 class UserPermsService(BaseService):
@@ -14,53 +22,117 @@ class UserPermsService(BaseService):
 
     def get_user_perms_list(self, user_id: str) -> list[Permission]:
         """Get User list of Permissions. """
+        # Permissions of all the roles of the user in a single query
+        perms: list[Permission] = Permission.query.join(
+            RolePermission,
+            RolePermission.permission_id == Permission.permission_id).join(
+            RoleOwner, RoleOwner.role_id == RolePermission.role_id).filter(
+            RoleOwner.owner_id == user_id).distinct().all()
+        if perms:
+            return perms
+
+        # The user only needs to be looked up to tell why there are none
         existing_user: User = User.query.get(user_id)
         if not existing_user:
             error_code = self.USER_NOT_FOUND.code
             message = self.USER_NOT_FOUND.message
             raise ServiceException(error_code=error_code, message=message)
+        return []
+
+    def check_user_perm(self, user_id: str, perm_id: str) -> bool:
+        """Check if User with given UUID have Permission with given UUID. """
+        result = self.check_user_perms([(user_id, perm_id)])[0]
+        if 'error' in result:
+            rcode = getattr(self, result['error'])
+            raise ServiceException(error_code=rcode.code,
+                                   message=rcode.message)
+        return result['is_permitted']
 
-        existing_role_ownership = RoleOwner.query.filter(
-            RoleOwner.owner_id == user_id).all()
-        if not existing_role_ownership:
-            return []
+    def check_user_perms(self, checks: list[tuple]) -> list[dict]:
+        """Answer many (user UUID, permission UUID) checks at once: one
+        cache lookup per user, the permissions of the users missing from
+        the cache are resolved from their roles in the RBAC snapshot.
+        Checks of unknown users or permissions get an error code. """
+        checks = [(str(user_id), str(perm_id)) for user_id, perm_id in checks]
+        perms_by_user: dict[str, list[str]] = defaultdict(list)
+        for user_id, perm_id in checks:
+            if perm_id not in perms_by_user[user_id]:
+                perms_by_user[user_id].append(perm_id)
 
-        role_ids = [ro.role_id for ro in existing_role_ownership]
+        decisions: dict[tuple[str, str], bool] = {}
+        errors: dict[str, str] = {}
+        undecided: dict[str, list[str]] = {}
+        unknown_perms: set[str] = set()
+        lookups: dict[str, PermDecisions] = {}
+        # Only tokens embedding the permissions can answer, the others
+        # aren't verified at all
+        claims = get_verified_claims() if config.jwt_embed_permissions \
+            else {}
+        for user_id, perm_ids in perms_by_user.items():
+            if 'perms' in claims and claims.get('user_id') == user_id:
+                # Same answers as below for permissions that don't exist
+                snapshot = rbac_snapshots.current()
+                for perm_id in perm_ids:
+                    if has_permission(claims, perm_id):
+                        decisions[user_id, perm_id] = True
+                    elif snapshot.permission_exists(perm_id):
+                        decisions[user_id, perm_id] = False
+                    else:
+                        unknown_perms.add(perm_id)
+                continue
 
-        existing_rps = [
-            RolePermission.query.filter(RolePermission.role_id == r_id).all()
-            for
-            r_id in role_ids]
-        rp_list = [val for sublist in existing_rps for val in sublist]
-        rp_list = list(set(rp_list))
-        return [Permission.query.get(rp.permission_id) for rp in rp_list]
+            lookups[user_id] = lookup = get_perm_decisions(user_id, perm_ids)
+            user_decisions = lookup.decisions
+            if not lookup.cached:
+                # Resolved in memory from the roles of the user
+                role_ids = get_user_role_ids(user_id)
+                if role_ids is None:
+                    errors[user_id] = self.USER_NOT_FOUND.code
+                    continue
+                # At least as new as the RBAC version read along, which
+                # may be ahead of the worker's snapshot
+                snapshot = rbac_snapshots.current(
+                    int(lookup.rbac_version or 0))
+                granted = store_user_perms(
+                    user_id, snapshot.permission_ids_of(role_ids), lookup)
+                user_decisions.update({perm_id: True for perm_id in perm_ids
+                                       if perm_id in granted})
+            for perm_id, is_permitted in user_decisions.items():
+                decisions[user_id, perm_id] = is_permitted
+            missing = [perm_id for perm_id in perm_ids
+                       if perm_id not in user_decisions]
+            if missing:
+                undecided[user_id] = missing
 
-    def check_user_perm(self, user_id: str, perm_id: str) -> bool:
-        """Check if User with given UUID have Permission with given UUID. """
-        cache_value = redis.get(f'{user_id}:{perm_id}')
-        if cache_value == 'denied':
-            return False
-        if cache_value == 'accepted':
-            return True
+        # Not granted, unless the permission doesn't exist at all
+        if undecided:
+            snapshot = rbac_snapshots.current(max(
+                int(lookups[user_id].rbac_version or 0)
+                for user_id in undecided))
+            unknown_perms.update(perm_id for perm_ids in undecided.values()
+                                 for perm_id in perm_ids
+                                 if not snapshot.permission_exists(perm_id))
+        for user_id, perm_ids in undecided.items():
+            denied = [perm_id for perm_id in perm_ids
+                      if perm_id not in unknown_perms]
+            if denied:
+                remember_denied(user_id, denied, lookups[user_id])
+            decisions.update({(user_id, perm_id): False
+                              for perm_id in denied})
 
-        existing_permission: Permission = Permission.query.filter(
-            Permission.permission_id == perm_id).first()
-        if not existing_permission:
-            error_code = self.PERMISSION_NOT_FOUND.code
-            message = self.PERMISSION_NOT_FOUND.message
-            raise ServiceException(error_code=error_code, message=message)
+        results = []
+        for user_id, perm_id in checks:
+            result = {'user_uuid': user_id, 'permission_uuid': perm_id}
+            if user_id in errors:
+                result['error'] = errors[user_id]
+            elif perm_id in unknown_perms and (
+                    user_id, perm_id) not in decisions:
+                result['error'] = self.PERMISSION_NOT_FOUND.code
+            else:
+                result['is_permitted'] = decisions[user_id, perm_id]
+            results.append(result)
+        return results
 
-        user_perms: list[Permission] = self.get_user_perms_list(user_id)
-        perm_ids: list[str] = [perm.permission_id for perm in user_perms]
-        if perm_id in perm_ids:
-            redis.set(
-                name=f'{user_id}:{perm_id}',
-                value='accepted',
-                ex=config.cache_time)
-            return True
-        else:
-            redis.set(
-                name=f'{user_id}:{perm_id}',
-                value='denied',
-                ex=config.cache_time)
-            return False
+    def validate_checks(
+            self, request: Request) -> Union[PermissionCheckRequest, Response]:
+        return self._validate(request, PermissionCheckRequest)
@@ -5,8 +5,17 @@ from db.pg import db
 from flask import Request, Response
 from models.role import Role
 from models.roles_owners import RoleOwner
-from models.user import User, UserRoleAssignRequest
+from models.user import BulkUserRoleRequest, User, UserRoleAssignRequest
 from services.base import BaseService
+from services.perms_cache import invalidate_user_perms
+from services.roles_cache import invalidate_user_roles
+from services.token_claims import invalidate_user_claims
+from sqlalchemy import tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import joinedload
+
+# Pairs inserted or deleted by a single statement of a bulk change
+BULK_CHUNK_SIZE = 1000
 
 
 class UserRoleService(BaseService):
@@ -14,18 +23,20 @@ class UserRoleService(BaseService):
         pass
 
     def get_user_roles_list(self, user_id: str) -> list[Role]:
+        # The roles are joined to the ownerships in a single query
+        existing_role_ownership: list[RoleOwner] = RoleOwner.query.options(
+            joinedload(RoleOwner.role)).filter(
+            RoleOwner.owner_id == user_id).all()
+        if existing_role_ownership:
+            return [ro.role for ro in existing_role_ownership]
+
+        # The user only needs to be looked up to tell why there are none
         existing_user: User = User.query.get(user_id)
         if not existing_user:
             error_code = self.USER_NOT_FOUND.code
             message = self.USER_NOT_FOUND.message
             raise ServiceException(error_code=error_code, message=message)
-
-        existing_role_ownership = RoleOwner.query.filter(
-            RoleOwner.owner_id == user_id).all()
-
-        role_ids = [ro.role_id for ro in existing_role_ownership]
-        roles = [Role.query.get(role_id) for role_id in role_ids]
-        return roles
+        return []
 
     def assign_user_role(self, user_id: str, role_id: str) -> Role:
         existing_user: User = User.query.get(user_id)
@@ -51,6 +62,9 @@ class UserRoleService(BaseService):
         new_role_ownership = RoleOwner(owner_id=user_id, role_id=role_id)
         db.session.add(new_role_ownership)
         db.session.commit()
+        invalidate_user_claims([user_id])
+        invalidate_user_perms([user_id])
+        invalidate_user_roles([user_id])
 
         new_role: Role = Role.query.get(role_id)
         return new_role
@@ -78,8 +92,108 @@ class UserRoleService(BaseService):
         role = Role.query.get(role_id)
         db.session.delete(existing_role_ownership)
         db.session.commit()
+        invalidate_user_claims([user_id])
+        invalidate_user_perms([user_id])
+        invalidate_user_roles([user_id])
         return role
 
     def validate_assignment(
             self, request: Request) -> Union[UserRoleAssignRequest, Response]:
         return self._validate(request, UserRoleAssignRequest)
+
+    def validate_bulk_assignment(
+            self, request: Request) -> Union[BulkUserRoleRequest, Response]:
+        return self._validate(request, BulkUserRoleRequest)
+
+    def assign_user_roles(self, pairs: list[tuple]) -> list[dict]:
+        """Assign many roles to many users in a single transaction.
+        Returns a result for every (user UUID, role UUID) pair, in order,
+        with an error code for the pairs that could not be assigned. """
+        pairs = [(str(user_id), str(role_id)) for user_id, role_id in pairs]
+        errors = self._check_bulk_pairs(pairs)
+        valid = list(dict.fromkeys(
+            pair for pair in pairs if pair not in errors))
+
+        assigned = set()
+        table = RoleOwner.__table__
+        for start in range(0, len(valid), BULK_CHUNK_SIZE):
+            chunk = valid[start:start + BULK_CHUNK_SIZE]
+            statement = insert(table).values(
+                [{'owner_id': user_id, 'role_id': role_id}
+                 for user_id, role_id in chunk]).on_conflict_do_nothing(
+                index_elements=[table.c.owner_id, table.c.role_id]
+            ).returning(table.c.owner_id, table.c.role_id)
+            assigned.update((str(user_id), str(role_id))
+                            for user_id, role_id in
+                            db.session.execute(statement))
+        db.session.commit()
+        self._invalidate_users({user_id for user_id, _ in assigned})
+
+        return self._bulk_results(pairs, errors, assigned, 'assigned',
+                                  self.ROLE_EXISTS)
+
+    def revoke_user_roles(self, pairs: list[tuple]) -> list[dict]:
+        """Remove many roles from many users in a single transaction,
+        with a result for every pair like ``assign_user_roles``. """
+        pairs = [(str(user_id), str(role_id)) for user_id, role_id in pairs]
+        errors = self._check_bulk_pairs(pairs)
+        valid = list(dict.fromkeys(
+            pair for pair in pairs if pair not in errors))
+
+        revoked = set()
+        table = RoleOwner.__table__
+        for start in range(0, len(valid), BULK_CHUNK_SIZE):
+            chunk = valid[start:start + BULK_CHUNK_SIZE]
+            statement = table.delete().where(
+                tuple_(table.c.owner_id, table.c.role_id).in_(chunk)
+            ).returning(table.c.owner_id, table.c.role_id)
+            revoked.update((str(user_id), str(role_id))
+                           for user_id, role_id in
+                           db.session.execute(statement))
+        db.session.commit()
+        self._invalidate_users({user_id for user_id, _ in revoked})
+
+        return self._bulk_results(pairs, errors, revoked, 'revoked',
+                                  self.NO_ROLE_OWNERSHIP)
+
+    def _check_bulk_pairs(self, pairs: list[tuple[str, str]]) -> dict:
+        """Error codes of the pairs with an unknown user or role,
+        checked with one query for all the users and one for the roles"""
+        user_ids = {user_id for user_id, _ in pairs}
+        role_ids = {role_id for _, role_id in pairs}
+        existing_users = {str(user_id) for user_id, in db.session.query(
+            User.user_id).filter(User.user_id.in_(user_ids))}
+        existing_roles = {str(role_id) for role_id, in db.session.query(
+            Role.role_id).filter(Role.role_id.in_(role_ids))}
+
+        errors = {}
+        for user_id, role_id in pairs:
+            if user_id not in existing_users:
+                errors[user_id, role_id] = self.USER_NOT_FOUND.code
+            elif role_id not in existing_roles:
+                errors[user_id, role_id] = self.ROLE_NOT_FOUND.code
+        return errors
+
+    @staticmethod
+    def _bulk_results(pairs: list[tuple[str, str]], errors: dict,
+                      changed: set, status: str, unchanged) -> list[dict]:
+        results = []
+        # Repeated pairs only change once
+        changed = set(changed)
+        for pair in pairs:
+            result = {'user_uuid': pair[0], 'role_uuid': pair[1]}
+            if pair in errors:
+                result['error'] = errors[pair]
+            elif pair in changed:
+                result['status'] = status
+                changed.discard(pair)
+            else:
+                result['error'] = unchanged.code
+            results.append(result)
+        return results
+
+    @staticmethod
+    def _invalidate_users(user_ids: set[str]) -> None:
+        invalidate_user_claims(user_ids)
+        invalidate_user_perms(user_ids)
+        invalidate_user_roles(user_ids)
@@ -81,6 +81,13 @@ def make_get_request(session):
     return inner
 
 
+@pytest.fixture(scope='session')
+def app():
+    """The service in-process, for the tests counting its queries"""
+    from main import create_app
+    return create_app()
+
+
 @pytest.fixture
 def redis_conn():
     r = Redis(redis_details['host'],
@@ -142,7 +149,8 @@ def make_patch_request(session):
 def make_delete_request(session):
     async def inner(method: str,
                     params: dict = None,
-                    headers: dict = None) -> HTTPResponse:
+                    headers: dict = None,
+                    json: dict = None) -> HTTPResponse:
         params = params or {}
         headers = headers or {}
         url = '{protocol}://{host}:{port}/api/v{api_version}/{method}'.format(
@@ -152,8 +160,8 @@ def make_delete_request(session):
             api_version=config.service_api_version,
             method=method
         )
-        async with session.delete(url,
-                                  params=params, headers=headers) as response:
+        async with session.delete(url, params=params, headers=headers,
+                                  json=json) as response:
             return HTTPResponse(
                 body=await response.json(),
                 headers=response.headers,
@@ -204,6 +212,9 @@ async def get_superuser_token(pg_curs, redis_conn):
     # Remove superuser and superadmin role
     remove_user(pg_curs, user_id=su_user_uuid)
     remove_role(pg_curs, role_id=su_role_uuid)
+    # The role was deleted behind the service, which memoizes its ID
+    redis_conn.publish(config.cache_invalidation_channel,
+                       f'role_id:{config.service_admin_role}')
 
 
 @pytest.fixture(scope='function')
@@ -21,6 +21,8 @@ class TestSettings(BaseSettings):
     access_token_expiration: int
     jwt_secret_key: str
     cache_time: int
+    cache_invalidation_channel: str
+    preauth_login_max_attempts: int
     async_api_url: str
 
 
@@ -42,6 +44,9 @@ test_settings = {
     'access_token_expiration': os.getenv('ACCESS_TOKEN_EXPIRATION'),
     'jwt_secret_key': os.getenv('JWT_SECRET_KEY'),
     'cache_time': os.getenv('CACHE_TIME'),
+    'cache_invalidation_channel': os.getenv('CACHE_INVALIDATION_CHANNEL'),
+    'preauth_login_max_attempts': os.getenv('PREAUTH_LOGIN_MAX_ATTEMPTS',
+                                            10),
     'async_api_url': os.getenv('ASYNC_API_URL'),
 }
 config = TestSettings.parse_obj(test_settings)
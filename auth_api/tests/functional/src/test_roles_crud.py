@@ -190,7 +190,7 @@ async def test_user_role_assigment(make_post_request, make_get_request,
     assert assigned_permission.permission_name == 'testing_per'
 
     # Check cache for that user and permission is empty
-    cache = await redis_client.get(f'{user_uuid}:{perm_uuid}')
+    cache = await redis_client.hget(f'perms:{user_uuid}', perm_uuid)
     assert not cache
 
     # Check if created User don't have permission by uuid till it assigned
@@ -203,8 +203,8 @@ async def test_user_role_assigment(make_post_request, make_get_request,
     assert not perm_check.is_permitted
 
     # Check cache for that user and permission is false
-    cache = await redis_client.get(f'{user_uuid}:{perm_uuid}')
-    assert cache == 'denied'
+    cache = await redis_client.hget(f'perms:{user_uuid}', perm_uuid)
+    assert cache == '0'
 
     # Assign created role to created user
     response = await make_post_request(f'user/{user_uuid}/roles',
@@ -250,8 +250,20 @@ async def test_user_role_assigment(make_post_request, make_get_request,
     assert perm_check.is_permitted
 
     # Check user permission is cached
-    cache = await redis_client.get(f'{user_uuid}:{perm_uuid}')
-    assert cache == 'accepted'
+    cache = await redis_client.hget(f'perms:{user_uuid}', perm_uuid)
+    assert cache == '1'
+
+    # Check the permission in a batch, along with an unknown one
+    unknown_uuid = '00000000-0000-0000-0000-000000000000'
+    response = await make_post_request(
+        'user/permissions/check',
+        json={'user_uuid': user_uuid,
+              'permission_uuids': [perm_uuid, unknown_uuid]})
+    assert response.status == HTTPStatus.OK
+    results = response.body['results']
+    assert len(results) == 2
+    assert results[0]['is_permitted']
+    assert results[1]['error'] == 'PERMISSION_NOT_FOUND'
 
     # Remove assigned role from created user
     response = await make_delete_request(
@@ -302,3 +314,103 @@ async def test_user_role_assigment(make_post_request, make_get_request,
 
     # Remove created user
     remove_user(pg_curs, user_uuid)
+
+
+@pytest.mark.asyncio
+async def test_bulk_user_role_assigment(make_post_request, make_get_request,
+                                        make_delete_request, pg_curs,
+                                        get_superuser_token):
+    """Test bulk Role assigment and removal with a result for every pair:
+    changed, repeated, already (un)assigned, unknown user or role. """
+    access_token = get_superuser_token
+    unknown_uuid = '00000000-0000-0000-0000-000000000000'
+
+    # Create two users and save their uuids
+    user_uuids = []
+    for username in ('bulk_test_user_1', 'bulk_test_user_2'):
+        response = await make_post_request(
+            'user/signup',
+            json={'username': username,
+                  'password': 'some_password',
+                  'email': f'{username}@email.com'})
+        assert response.status == HTTPStatus.OK
+        user_uuids.append(str(get_user_uuid(pg_curs, username=username)))
+    first_uuid, second_uuid = user_uuids
+
+    # Create new role and save it's uuid
+    response = await make_post_request('role/',
+                                       json={'role_name': 'bulk_role'},
+                                       headers=get_auth_headers(access_token))
+    created_role = await extract_role(response)
+    assert response.status == HTTPStatus.OK
+    role_uuid = str(created_role.uuid)
+
+    # The second user already owns the role
+    response = await make_post_request(f'user/{second_uuid}/roles',
+                                       json={'role_uuid': role_uuid},
+                                       headers=get_auth_headers(access_token))
+    assert response.status == HTTPStatus.OK
+
+    pairs = [(first_uuid, role_uuid),
+             (first_uuid, role_uuid),
+             (second_uuid, role_uuid),
+             (unknown_uuid, role_uuid),
+             (first_uuid, unknown_uuid)]
+    assignments = [{'user_uuid': user_uuid, 'role_uuid': role_uuid}
+                   for user_uuid, role_uuid in pairs]
+
+    # Assign the role in bulk
+    response = await make_post_request('user/roles/bulk',
+                                       json={'assignments': assignments},
+                                       headers=get_auth_headers(access_token))
+    assert response.status == HTTPStatus.OK
+    results = response.body['results']
+    assert [(result['user_uuid'], result['role_uuid'])
+            for result in results] == pairs
+    assert results[0]['status'] == 'assigned'
+    # Repeated pairs are only assigned once
+    assert results[1]['error'] == 'ROLE_EXISTS'
+    assert results[2]['error'] == 'ROLE_EXISTS'
+    assert results[3]['error'] == 'USER_NOT_FOUND'
+    assert results[4]['error'] == 'ROLE_NOT_FOUND'
+
+    # Both users own the role once
+    for user_uuid in user_uuids:
+        response = await make_get_request(
+            f'user/{user_uuid}/roles',
+            headers=get_auth_headers(access_token))
+        user_roles = await extract_roles(response)
+        assert response.status == HTTPStatus.OK
+        assert len(user_roles) == 1
+        assert user_roles[0].role_name == 'bulk_role'
+
+    # Remove the role in bulk
+    response = await make_delete_request(
+        'user/roles/bulk',
+        json={'assignments': assignments[:4]},
+        headers=get_auth_headers(access_token))
+    assert response.status == HTTPStatus.OK
+    results = response.body['results']
+    assert len(results) == 4
+    assert results[0]['status'] == 'revoked'
+    assert results[1]['error'] == 'NO_ROLE_OWNERSHIP'
+    assert results[2]['status'] == 'revoked'
+    assert results[3]['error'] == 'USER_NOT_FOUND'
+
+    # Check role is excluded from users role list
+    for user_uuid in user_uuids:
+        response = await make_get_request(
+            f'user/{user_uuid}/roles',
+            headers=get_auth_headers(access_token))
+        user_roles = await extract_roles(response)
+        assert response.status == HTTPStatus.OK
+        assert len(user_roles) == 0
+
+    # Remove created role and users
+    response = await make_delete_request(
+        f'role/{role_uuid}',
+        headers=get_auth_headers(access_token)
+    )
+    assert response.status == HTTPStatus.OK
+    for user_uuid in user_uuids:
+        remove_user(pg_curs, user_uuid)
@@ -0,0 +1,71 @@
+import random
+import string
+
+import pytest
+import services.user
+import services.user_filter
+from core.bloom import RedisBloomFilter
+from core.utils import ServiceException
+from db.pg import count_queries, db
+from db.redis_client import flush_deferred_redis
+from redis import Redis
+from services.user import UserService
+
+FILTERS = ('login_filter', 'email_filter')
+
+
+@pytest.fixture
+def empty_user_filters(monkeypatch, redis_conn: Redis):
+    """Filters of the test only holding the users it signs up,
+    so whether a user is looked up first is known upfront"""
+    keys = []
+    for name in FILTERS:
+        bloom = RedisBloomFilter(f'test:bloom:{name}', 1000)
+        bloom.rebuild([])
+        keys.extend([bloom.key, f'{bloom.key}:ready'])
+        monkeypatch.setattr(services.user, name, bloom)
+        monkeypatch.setattr(services.user_filter, name, bloom)
+    yield
+    redis_conn.delete(*keys)
+
+
+@pytest.fixture
+def username(pg_conn, pg_curs):
+    username = ''.join(random.choices(string.ascii_lowercase, k=10))
+    yield username
+    pg_curs.execute('delete from app.users where user_login=%s', (username,))
+    pg_conn.commit()
+
+
+def signup(username: str, email: str) -> list[str]:
+    """Statements sent to Postgres by the creation of the user"""
+    with count_queries() as statements:
+        try:
+            UserService().create_user(username, username, email)
+        finally:
+            db.session.rollback()
+            flush_deferred_redis()
+    return statements
+
+
+class TestSignup:
+    def test_signup_is_a_single_statement(self, app, empty_user_filters,
+                                          username: str):
+        with app.test_request_context():
+            statements = signup(username, f'{username}@yandex.com')
+        assert len(statements) == 1, statements
+
+    def test_duplicate_signup_is_a_single_lookup(self, app,
+                                                 empty_user_filters,
+                                                 username: str):
+        with app.test_request_context():
+            signup(username, f'{username}@yandex.com')
+        with app.test_request_context():
+            with pytest.raises(ServiceException) as err:
+                with count_queries() as statements:
+                    UserService().create_user(
+                        username, username, f'other.{username}@yandex.com')
+            flush_deferred_redis()
+        assert err.value.error_code == UserService.LOGIN_EXISTS.code
+        # Rejected before the password is hashed and the user inserted
+        assert len(statements) == 1, statements
@@ -8,6 +8,7 @@ from pydantic import BaseModel, constr
 from redis import Redis
 from requests import Response
 from tests.functional.settings import config
+from werkzeug.security import check_password_hash
 
 
 def dictfetchall(cursor):
@@ -133,6 +134,15 @@ class TestUser:
         assert user["user_email"] == valid_data["email"], \
             "Wrong email after adding a user"
 
+        pg_curs.execute("select user_id from app.user_logins "
+                        "where user_login=%s", (valid_data["username"],))
+        assert dictfetchall(pg_curs).pop()["user_id"] == user["user_id"], \
+            "Login not found in the directory after adding a user"
+        pg_curs.execute("select user_id from app.user_emails "
+                        "where user_email=%s", (valid_data["email"],))
+        assert dictfetchall(pg_curs).pop()["user_id"] == user["user_id"], \
+            "Email not found in the directory after adding a user"
+
         #
         # Inability to create duplicated users
         #
@@ -244,6 +254,43 @@ class TestUser:
         pg_curs.execute(query, (user['user_id'],))
         pg_conn.commit()
 
+    def test_token_reuse_revokes_family(self, pg_conn: connection,
+                                        pg_curs: cursor,
+                                        redis_conn: Redis):
+        username = password = "".join(
+            random.choices(string.ascii_lowercase, k=10))
+        email = username + "@yandex.com"
+
+        valid_data = {
+            "username": username, "password": password, "email": email
+        }
+
+        response, user = create_user(valid_data, pg_curs, redis_conn)
+
+        old_refresh_token = response.json()['refresh_token']
+        response = json_api_request(
+            'PUT', 'user/auth', {},
+            {'Authorization': 'Bearer ' + old_refresh_token})
+        assert response.status_code == 200, "Refresh failed"
+        new_refresh_token = response.json()['refresh_token']
+
+        # Replaying the rotated token revokes the whole family,
+        # the newest token included
+        response = requests.put(
+            get_base_url('user/auth'),
+            headers={'Authorization': 'Bearer ' + old_refresh_token})
+        assert response.status_code != 200, "Rotated token accepted"
+
+        response = requests.put(
+            get_base_url('user/auth'),
+            headers={'Authorization': 'Bearer ' + new_refresh_token})
+        assert response.status_code != 200, \
+            "Newest token accepted after reuse of its family"
+
+        query = "delete from app.users where user_id=%s"
+        pg_curs.execute(query, (user['user_id'],))
+        pg_conn.commit()
+
     def test_logout(self, pg_conn: connection,
                     pg_curs: cursor,
                     redis_conn: Redis):
@@ -318,14 +365,21 @@ class TestUser:
 
         query = "select user_login,user_password " \
                 "from app.users where user_id=%s"
-        pg_curs.execute(query, (user['user_id'],))
+        user_id = user['user_id']
+        pg_curs.execute(query, (user_id,))
         user = dictfetchall(pg_curs).pop()
 
         assert user["user_login"] == modified_data["username"], \
             "username didn't change in the database"
-        assert user["user_password"] == modified_data["password"], \
+        assert check_password_hash(user["user_password"],
+                                   modified_data["password"]), \
             "password didn't change in the database"
 
+        pg_curs.execute("select user_login from app.user_logins "
+                        "where user_id=%s", (user_id,))
+        assert [row["user_login"] for row in dictfetchall(pg_curs)] == [
+            modified_data["username"]], "login directory wasn't updated"
+
     def test_history(self, pg_curs: cursor,
                      redis_conn: Redis):
         username = password = "".join(
@@ -351,3 +405,60 @@ class TestUser:
         response = json_api_request('GET', 'user/auth', {}, headers)
 
         assert len(response.json()) > 0, "No history events found"
+        assert 'X-RateLimit-Remaining' in response.headers, \
+            "No rate limit headers"
+
+    def test_history_pagination(self, pg_curs: cursor,
+                                redis_conn: Redis):
+        username = password = "".join(
+            random.choices(string.ascii_lowercase, k=10))
+        email = username + "@yandex.com"
+
+        valid_data = {
+            "username": username, "password": password, "email": email
+        }
+
+        response, user = create_user(valid_data, pg_curs, redis_conn)
+
+        access_token = response.json()['access_token']
+        headers = {
+            'Authorization': 'Bearer ' + access_token
+        }
+
+        del valid_data["email"]
+        json_api_request("post", "user/auth", valid_data)
+        json_api_request("post", "user/auth", valid_data)
+
+        response = json_api_request('GET', 'user/auth?limit=1', {}, headers)
+        first_page = response.json()
+        assert len(first_page) == 1, "Page limit not applied"
+        assert 'X-Next-Cursor' in response.headers, "No next page cursor"
+
+        response = json_api_request(
+            'GET',
+            'user/auth?limit=1&after=' + response.headers['X-Next-Cursor'],
+            {}, headers)
+        second_page = response.json()
+        assert len(second_page) == 1, "No second page of history"
+        assert second_page[0]['uuid'] != first_page[0]['uuid'], \
+            "The second page repeats the first one"
+
+    def test_login_attempts_throttled(self):
+        username = password = "".join(
+            random.choices(string.ascii_lowercase, k=10))
+        login_data = {"username": username, "password": password}
+
+        # The attempts within the limit reach the service
+        for _ in range(config.preauth_login_max_attempts):
+            response = json_api_request("post", "user/auth", login_data)
+            assert response.status_code == 400, \
+                "Attempt within the limit was throttled"
+            assert response.json()['error_code'] == 'USER_NOT_FOUND'
+
+        # The next one on the same username is throttled
+        response = json_api_request("post", "user/auth", login_data)
+        assert response.status_code == 429, \
+            "No throttling past the login attempts limit"
+        assert response.json()['error_code'] == 'TOO_MANY_REQUESTS'
+        assert int(response.headers['Retry-After']) > 0, \
+            "No Retry-After header"